@@ -0,0 +1,102 @@
+"""
+A persistent cache of JSON values in the dev_db cache directory
+
+It keeps the model settings and the table sizes between the runs of
+create_dev_db, which the Django cache does not do with the default LocMem
+backend, see DevDBCreator.get_cached_model_settings.
+"""
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import time
+
+from dev_db.utils import get_cache_dir, model_name
+
+logger = logging.getLogger(__name__)
+VERSION = 1
+
+
+class DiskCache:
+    """
+    Stores every value in its own file, named after the hash of its key
+    """
+
+    def __init__(self, directory=None, prefix="cache"):
+        self.directory = directory or get_cache_dir()
+        self.prefix = prefix
+
+    def path(self, key):
+        digest = hashlib.sha1(key.encode("utf-8")).hexdigest()
+        return self.directory / ("%s-%s.json" % (self.prefix, digest))
+
+    def get(self, key, default=None):
+        try:
+            with open(self.path(key), encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, ValueError) as e:
+            logger.debug("cache miss for %s: %s", key, e)
+            return default
+
+        if (
+            data.get("version") != VERSION
+            or data.get("key") != key
+            or (data["expires"] is not None and data["expires"] < time.time())
+        ):
+            return default
+
+        return data["value"]
+
+    def set(self, key, value, timeout=None):
+        """
+        Stores the value for timeout seconds, forever if None
+
+        The file is written to a temporary file first and renamed, so a
+        concurrent run never reads a partial value
+        """
+        data = {
+            "version": VERSION,
+            "key": key,
+            "expires": None if timeout is None else time.time() + timeout,
+            "value": value,
+        }
+
+        try:
+            self.directory.mkdir(parents=True, exist_ok=True)
+            fd, temporary = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                json.dump(data, f)
+
+            os.replace(temporary, self.path(key))
+        except OSError as e:
+            logger.warning("cannot cache %s: %s", key, e)
+
+    def delete(self, key):
+        try:
+            self.path(key).unlink()
+        except FileNotFoundError:
+            pass
+
+    def clear(self):
+        """
+        Deletes all the values of the cache
+        """
+        for path in self.directory.glob("%s-*.json" % self.prefix):
+            path.unlink()
+
+
+def schema_hash(models):
+    """
+    Hashes the tables and columns of the models
+    """
+    schema = sorted(
+        (
+            model_name(model),
+            model._meta.db_table,
+            [x.column for x in model._meta.local_concrete_fields],
+        )
+        for model in models
+    )
+    return hashlib.sha1(json.dumps(schema).encode("utf-8")).hexdigest()
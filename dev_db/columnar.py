@@ -0,0 +1,272 @@
+"""
+The devdb fixture format, storing every table as compressed column chunks
+
+    magic | chunk | chunk | ... | header | header length | magic
+
+A chunk holds up to CHUNK_ROWS rows of a single table, as a zlib compressed
+JSON array of its columns, the many to many fields being columns of pk lists.
+JSON, unlike marshal, reads the same on every Python version, so the files can
+be shared. The header is a JSON document with the schema of every table (model,
+columns, many to many fields), its row count, the offsets of its chunks and the
+order in which the tables should be loaded. It is written last, so the file is
+produced in a single pass with at most one chunk per table in memory, and
+read first by seeking from the end of the file.
+
+The values are stored like in the python serializer: the simple types as they
+are, the others converted with value_to_string and back with to_python.
+"""
+
+from collections import defaultdict
+import json
+import struct
+import zlib
+
+from django.apps import apps
+from django.core.exceptions import FieldDoesNotExist
+from django.core.serializers.base import DeserializationError, DeserializedObject
+
+from dev_db.dependencies import dependency_order
+from dev_db.utils import chunked, model_name
+
+FORMAT = "devdb"
+MAGIC = b"DEVDB\x00\x01\n"
+# 1 stored the chunks with marshal
+VERSION = 2
+# number of rows of a table in a chunk
+CHUNK_ROWS = 5000
+# default zlib compression level of the chunks
+LEVEL = 6
+# the maximum number of pks in the filter selecting many to many targets
+M2M_BATCH_SIZE = 500
+# values that are stored as they are, the bytes are stored as base64 strings by
+# value_to_string
+SIMPLE_TYPES = (type(None), bool, int, float, str)
+LENGTH = struct.Struct(">Q")
+# the label of the header in the profiles
+HEADER_LABEL = "devdb header"
+
+
+class ColumnarWriter:
+    def __init__(self, stream, chunk_rows=CHUNK_ROWS, level=LEVEL, profiler=None):
+        self.stream = stream
+        self.chunk_rows = chunk_rows
+        self.level = level
+        # a dev_db.profiling.Profiler, the compressed chunks are recorded for
+        # their model and the header, with the magic numbers, on its own
+        self.profiler = profiler
+        self.tables = {}
+        self.buffers = defaultdict(list)
+
+    def write(self, objects):
+        self.stream.write(MAGIC)
+
+        for obj in objects:
+            model = type(obj)._meta.concrete_model
+            buffer = self.buffers[model]
+            buffer.append(obj)
+
+            if len(buffer) >= self.chunk_rows:
+                self.write_chunk(model, buffer)
+                buffer.clear()
+
+        for model, buffer in self.buffers.items():
+            if buffer:
+                self.write_chunk(model, buffer)
+
+        header = json.dumps(
+            {
+                "version": VERSION,
+                "tables": list(self.tables.values()),
+                "order": [model_name(x) for x in dependency_order(self.tables)],
+            }
+        ).encode("utf-8")
+        self.stream.write(header)
+        self.stream.write(LENGTH.pack(len(header)))
+        self.stream.write(MAGIC)
+
+        if self.profiler is not None:
+            size = 2 * len(MAGIC) + len(header) + LENGTH.size
+            self.profiler.written(HEADER_LABEL, size)
+
+    def write_chunk(self, model, instances):
+        fields, m2m_fields = get_fields(model)
+
+        if model not in self.tables:
+            self.tables[model] = {
+                "model": model_name(model),
+                "columns": [x.attname for x in fields],
+                "m2m": [x.name for x in m2m_fields],
+                "rows": 0,
+                "chunks": [],
+            }
+
+        columns = [[to_simple(x, obj) for obj in instances] for x in fields]
+
+        for field in m2m_fields:
+            # the targets of the whole chunk are selected from the through table
+            targets = m2m_targets(field, [obj.pk for obj in instances])
+            columns.append(
+                [
+                    [
+                        pk if isinstance(pk, SIMPLE_TYPES) else str(pk)
+                        for pk in targets.get(obj.pk, ())
+                    ]
+                    for obj in instances
+                ]
+            )
+
+        data = zlib.compress(
+            json.dumps(columns, separators=(",", ":")).encode("utf-8"), self.level
+        )
+        table = self.tables[model]
+        table["chunks"].append([self.stream.tell(), len(data), len(instances)])
+        table["rows"] += len(instances)
+        self.stream.write(data)
+
+        if self.profiler is not None:
+            self.profiler.written(table["model"], len(data))
+
+
+class ColumnarReader:
+    """
+    Reads a devdb fixture, with ignorenonexistent the tables and columns
+    missing from the project are skipped, like loaddata --ignorenonexistent
+    """
+
+    def __init__(self, stream, ignorenonexistent=False):
+        self.stream = stream
+        self.ignorenonexistent = ignorenonexistent
+        self.header = self.read_header()
+
+    def read_header(self):
+        self.stream.seek(-(LENGTH.size + len(MAGIC)), 2)
+        (length,) = LENGTH.unpack(self.stream.read(LENGTH.size))
+
+        if self.stream.read() != MAGIC:
+            raise DeserializationError("Not a %s fixture" % FORMAT)
+
+        self.stream.seek(-(LENGTH.size + len(MAGIC) + length), 2)
+        header = json.loads(self.stream.read(length))
+
+        if header["version"] != VERSION:
+            raise DeserializationError(
+                "Unsupported %s version %s, the fixture has to be written again "
+                "with this version of dev_db" % (FORMAT, header["version"])
+            )
+
+        return header
+
+    def __iter__(self):
+        """
+        Yields DeserializedObject, table by table in the dependency order
+        """
+        tables = {x["model"]: x for x in self.header["tables"]}
+
+        for label in self.header["order"]:
+            yield from self.read_table(tables[label])
+
+    def get_model(self, table):
+        """
+        The model of the table, None if it is missing and ignored
+        """
+        try:
+            return apps.get_model(table["model"])
+        except LookupError as e:
+            if self.ignorenonexistent:
+                return None
+            raise DeserializationError("Invalid model %s: %s" % (table["model"], e))
+
+    def kept(self, model, names):
+        """
+        The positions of the fields of the table to read
+        """
+        return [
+            i
+            for i, name in enumerate(names)
+            if not self.ignorenonexistent or has_field(model, name)
+        ]
+
+    def read_table(self, table):
+        model = self.get_model(table)
+
+        if model is None:
+            return
+
+        columns = self.kept(model, table["columns"])
+        names = [table["columns"][x] for x in columns]
+        fields = [model._meta.get_field(x) for x in names]
+        m2m_columns = self.kept(model, table["m2m"])
+        # the instances are built faster with positional arguments
+        attnames = [x.attname for x in model._meta.concrete_fields]
+        positional = attnames == names
+
+        for offset, length, _ in table["chunks"]:
+            self.stream.seek(offset)
+            data = json.loads(zlib.decompress(self.stream.read(length)))
+            values = [
+                [None if x is None else field.to_python(x) for x in data[i]]
+                for field, i in zip(fields, columns)
+            ]
+            m2m = [
+                (table["m2m"][i], data[len(table["columns"]) + i]) for i in m2m_columns
+            ]
+
+            for i, row in enumerate(zip(*values)):
+                if positional:
+                    instance = model(*row)
+                else:
+                    instance = model(**dict(zip(names, row)))
+
+                m2m_data = {name: x[i] for name, x in m2m}
+                yield DeserializedObject(instance, m2m_data)
+
+
+def get_fields(model):
+    """
+    The concrete fields and the many to many fields with auto created through
+    tables, the same fields the Django serializers write
+    """
+    fields = [
+        x for x in model._meta.local_concrete_fields if x.serialize or x.primary_key
+    ]
+    m2m_fields = [
+        x
+        for x in model._meta.local_many_to_many
+        if x.serialize and x.remote_field.through._meta.auto_created
+    ]
+    return fields, m2m_fields
+
+
+def m2m_targets(field, pks, batch_size=M2M_BATCH_SIZE):
+    """
+    Maps the pks to the pks of their targets in the many to many relation, with
+    a query on the through table per batch_size pks
+    """
+    through = field.remote_field.through
+    source = through._meta.get_field(field.m2m_field_name()).attname
+    target = through._meta.get_field(field.m2m_reverse_field_name()).attname
+    targets = defaultdict(list)
+
+    for chunk in chunked(pks, batch_size):
+        for pk, target_pk in through._base_manager.filter(
+            **{source + "__in": chunk}
+        ).values_list(source, target):
+            targets[pk].append(target_pk)
+
+    return targets
+
+
+def has_field(model, name):
+    try:
+        model._meta.get_field(name)
+    except FieldDoesNotExist:
+        return False
+    return True
+
+
+def to_simple(field, obj):
+    value = field.value_from_object(obj)
+
+    if isinstance(value, SIMPLE_TYPES):
+        return value
+    return field.value_to_string(obj)
@@ -1,22 +1,187 @@
 from collections import defaultdict
+import copy
 import logging
 from itertools import chain
 from operator import attrgetter, itemgetter
 
 import django.apps
 from django.contrib.auth import get_user_model
-from django.contrib.auth.models import Permission
-from django.contrib.contenttypes.models import ContentType
+from django.db import connection
 from django.utils.functional import cached_property
-from django.db.utils import NotSupportedError
-from django.db.models.fields.related import ManyToManyField
 
-from dev_db.decorators import cached
-from dev_db.dependencies import get_dependency_mapping
-from dev_db.utils import get_max_id, hash_instance, model_name
+from dev_db.cache import DiskCache, schema_hash
+from dev_db.dependencies import (
+    dependency_levels,
+    get_dependency_graph,
+    parent_first,
+    self_references,
+)
+from dev_db.estimators import DEFAULT_ROW_BYTES, TableSize, get_estimator
+from dev_db.incremental import row_hashes
+from dev_db.pksets import PkSet
+from dev_db.resolver import Budget, DependencyResolver, InstanceStream
+from dev_db.sampling import LatestSampler, sample_querysets
+from dev_db.utils import WorkerPool, chunked, model_name
 
 logger = logging.getLogger(__name__)
 DEFAULT_LIMIT = 30
+LARGE_TABLE_LIMIT = 10
+LARGE_TABLE_ROWS = 50
+FULL_REQUIRED_LIMIT = 2000
+DEFAULT_BATCH_SIZE = 500
+
+
+def _without_streams(method):
+    """
+    Wraps a list method of CollectedData which only sees the instances held in
+    the list, so it raises rather than ignore the streamed instances
+    """
+
+    def wrapper(self, *args):
+        if self.streams:
+            raise TypeError(
+                "%s is not supported on streamed data, iterate it instead"
+                % method.__name__
+            )
+
+        return method(self, *args)
+
+    return wrapper
+
+
+class CollectedData(list):
+    """
+    The collected instances, without duplicates
+
+    pks_by_model maps every concrete model to the PkSet of its collected rows,
+    an exact (model, pk) index the instances are checked against as they are
+    added, so a duplicate is dropped right away rather than by a later pass.
+
+    The list holds the instances loaded up front, e.g. the custom data, which
+    add_extra_data can append to. Iterating it then goes on with the instances
+    of the streams, loaded chunk by chunk, see dev_db.resolver.InstanceStream.
+    Copies and concatenations keep the streams, the list methods that cannot
+    see them (indexing, slicing, sorting...) raise while there are streams.
+    """
+
+    __getitem__ = _without_streams(list.__getitem__)
+    __setitem__ = _without_streams(list.__setitem__)
+    __delitem__ = _without_streams(list.__delitem__)
+    __reversed__ = _without_streams(list.__reversed__)
+    __mul__ = _without_streams(list.__mul__)
+    __rmul__ = _without_streams(list.__rmul__)
+    __imul__ = _without_streams(list.__imul__)
+    count = _without_streams(list.count)
+    index = _without_streams(list.index)
+    insert = _without_streams(list.insert)
+    pop = _without_streams(list.pop)
+    remove = _without_streams(list.remove)
+    reverse = _without_streams(list.reverse)
+    sort = _without_streams(list.sort)
+
+    def __init__(self, instances=()):
+        super().__init__()
+        self.pks_by_model = defaultdict(PkSet)
+        self.streams = []
+        self.extend(instances)
+
+    def append(self, instance):
+        pks = self.pks_by_model[type(instance)._meta.concrete_model]
+
+        if instance.pk not in pks:
+            pks.add(instance.pk)
+            super().append(instance)
+
+    def extend(self, instances):
+        for instance in instances:
+            self.append(instance)
+
+    def __iadd__(self, instances):
+        self.extend(instances)
+        return self
+
+    def __add__(self, instances):
+        data = self.copy()
+        data.extend(instances)
+        return data
+
+    def __radd__(self, instances):
+        data = type(self)(instances)
+        data.extend(super().__iter__())
+
+        for stream in self.streams:
+            # add_stream drops the pks already collected from the copy
+            data.add_stream(copy.copy(stream))
+
+        return data
+
+    def __contains__(self, instance):
+        meta = getattr(instance, "_meta", None)
+        pks = meta and self.pks_by_model.get(meta.concrete_model)
+        return pks is not None and instance.pk in pks
+
+    def copy(self):
+        """
+        A shallow copy, holding the same instances and streams
+        """
+        data = type(self)()
+        list.extend(data, super().__iter__())
+        data.pks_by_model = copy.deepcopy(self.pks_by_model)
+        data.streams = list(self.streams)
+        return data
+
+    __copy__ = copy
+
+    def clear(self):
+        super().clear()
+        self.pks_by_model.clear()
+        self.streams.clear()
+
+    def add_stream(self, stream):
+        """
+        Adds the instances of the stream, but the ones already collected
+        """
+        pks = self.pks_by_model[stream.model._meta.concrete_model]
+
+        if pks:
+            stream.pks = PkSet(x for x in stream.pks if x not in pks)
+
+        pks.update(stream.pks)
+        self.streams.append(stream)
+
+    def tables(self):
+        """
+        Maps every concrete model to the list of its instances and the list of
+        its streams
+        """
+        tables = defaultdict(lambda: ([], []))
+
+        for instance in super().__iter__():
+            tables[type(instance)._meta.concrete_model][0].append(instance)
+
+        for stream in self.streams:
+            tables[stream.model._meta.concrete_model][1].append(stream)
+
+        return tables
+
+    def __reduce__(self):
+        # copies and pickles are rebuilt from the instances, the default of
+        # lists would append them to the copied pks_by_model, dropping them all
+        instances = list(super().__iter__())
+        return (
+            type(self),
+            (instances,),
+            {"pks_by_model": self.pks_by_model, "streams": self.streams},
+        )
+
+    def __iter__(self):
+        yield from super().__iter__()
+
+        for stream in self.streams:
+            yield from stream
+
+    def __len__(self):
+        return super().__len__() + sum(map(len, self.streams))
 
 
 class DevDBCreator:
@@ -31,18 +196,59 @@ class DevDBCreator:
     """
 
     exclude_content_type = False
+    # only move pks around while resolving the dependencies, and load the full
+    # instances once per model at the end
+    resolve_pks_only = False
+    # only keep the pks of the collected rows, the instances are then loaded
+    # chunk by chunk while they are serialized, see CollectedData
+    stream = False
+    # the maximum number of pks sent in a single filter
+    batch_size = DEFAULT_BATCH_SIZE
+    # the number of threads, each with its own database connection, running
+    # the queries concurrently
+    workers = 1
+    # the total number of rows, or bytes, the samples should add up to; without
+    # them large tables get LARGE_TABLE_LIMIT rows and others DEFAULT_LIMIT
+    target_rows = None
+    target_bytes = None
+    # besides checking that the tables exist, query every model to catch other
+    # database errors (e.g. missing columns), at the cost of a query per model
+    probe_tables = False
+    # the sampling strategies of dev_db.sampling, samplers maps model labels
+    # (e.g. "auth.User") to the strategy used instead of the default one
+    default_sampler = LatestSampler()
+    samplers = {}
+    # caps on the total size of the collected data, once reached no more
+    # optional reverse dependencies are collected
+    max_rows = None
+    max_bytes = None
+    budget = None
+    # a dev_db.profiling.Profiler recording the queries of the collection
+    profiler = None
+    # seconds the model settings and table sizes are cached on disk
+    cache_timeout = 60 * 10
+
+    @cached_property
+    def cache(self):
+        return DiskCache()
+
+    @cached_property
+    def dependency_graph(self):
+        return get_dependency_graph(self.models)
 
     @cached_property
     def reverse_mapping(self):
-        return get_dependency_mapping(self.models)
+        return self.dependency_graph.mapping()
 
     @cached_property
     def forward_mapping(self):
-        mapping = defaultdict(set)
+        mapping = {}
+
+        for model in self.dependency_graph.models:
+            edges = self.dependency_graph.forward_edges(model)
 
-        for model, dependencies in self.reverse_mapping.items():
-            for dependency, attr in dependencies:
-                mapping[dependency].add((model, attr))
+            if edges:
+                mapping[model] = set(edges)
 
         return mapping
 
@@ -50,6 +256,10 @@ class DevDBCreator:
     def model_settings(self):
         return {x: y for x, y in self.get_cached_model_settings()}
 
+    @cached_property
+    def table_sizes(self):
+        return self.get_table_sizes()
+
     @cached_property
     def models(self):
         return self.get_models()
@@ -66,18 +276,30 @@ class DevDBCreator:
         all_models = self.get_all_models()
         valid_models = list(full_required)
 
+        table_names = set(connection.introspection.table_names(include_views=True))
+
         for model in all_models:
             if (
                 model not in valid_models
                 and all(map(lambda x: x not in model._meta.db_table, excluded))
                 and not model._meta.proxy
             ):
-                try:
-                    model._default_manager.first()  # trigger potential database errors
-                except Exception as e:
-                    logger.error("%s: %s", type(e).__name__, e)
-                else:
-                    valid_models.append(model)
+                if model._meta.db_table not in table_names:
+                    logger.error(
+                        "%s: table %s does not exist",
+                        model_name(model),
+                        model._meta.db_table,
+                    )
+                    continue
+
+                if self.probe_tables:
+                    try:
+                        model._default_manager.first()  # trigger potential database errors
+                    except Exception as e:
+                        logger.error("%s: %s", type(e).__name__, e)
+                        continue
+
+                valid_models.append(model)
 
         logger.info("processing models: %s", list(map(model_name, valid_models)))
 
@@ -89,127 +311,336 @@ class DevDBCreator:
         """
         model_settings = []
         full_required = self.get_full_required()
+        table_sizes = self.table_sizes
+        target_limits = self.get_target_limits(
+            {x: y for x, y in table_sizes.items() if x not in full_required}
+        )
 
         for model in self.models:
-            logger.info("getting settings for %s", model_name(model))
-            max_id = get_max_id(model)
-            if max_id > 50:
-                limit = 10
+            size = table_sizes.get(model, TableSize(0, None))
+            logger.info(
+                "getting settings for %s (%d rows)", model_name(model), size.rows
+            )
+            if model in full_required:
+                limit = FULL_REQUIRED_LIMIT
+            elif model in target_limits:
+                limit = target_limits[model]
+            elif size.rows > LARGE_TABLE_ROWS:
+                limit = LARGE_TABLE_LIMIT
             else:
                 limit = DEFAULT_LIMIT
-            if model in full_required:
-                limit = 2000
             setting = (model, limit)
             model_settings.append(setting)
         return model_settings
 
+    def get_sampler(self, model):
+        return self.samplers.get(model_name(model), self.default_sampler)
+
+    def get_sample_requests(self, model, limit):
+        """
+        The resolver requests of the querysets sampling the model
+        """
+        sample = self.get_sampler(model).sample(
+            model, limit, self.table_sizes.get(model), self.batch_size
+        )
+        return [(model, x, False, None, "sample") for x in sample_querysets(sample)]
+
+    def get_estimator(self):
+        return get_estimator(connection)
+
+    def get_table_sizes(self):
+        """
+        Estimates the size of all the tables at once, see dev_db.estimators
+        """
+        return self.get_estimator().estimate(self.models)
+
+    def get_target_limits(self, table_sizes):
+        """
+        Splits target_rows and target_bytes between the tables
+        """
+        limits = {}
+
+        if self.target_rows is not None:
+            limits = self._split_target(self.target_rows, table_sizes, lambda x: 1)
+
+        if self.target_bytes is not None:
+            known = [
+                x.bytes / x.rows for x in table_sizes.values() if x.rows and x.bytes
+            ]
+            default = sum(known) / len(known) if known else DEFAULT_ROW_BYTES
+            by_bytes = self._split_target(
+                self.target_bytes,
+                table_sizes,
+                lambda x: x.bytes / x.rows if x.rows and x.bytes else default,
+            )
+            limits = {
+                model: min(limits.get(model, limit), limit)
+                for model, limit in by_bytes.items()
+            }
+
+        return limits
+
+    def _split_target(self, target, table_sizes, row_size):
+        """
+        Every table gets an equal share of the target, and the share a small
+        table cannot use is split again between the larger ones
+        """
+        limits = {}
+        remaining = float(target)
+        tables = sorted(
+            table_sizes.items(),
+            key=lambda x: (x[1].rows * row_size(x[1]), model_name(x[0])),
+        )
+
+        for i, (model, size) in enumerate(tables):
+            share = min(size.rows * row_size(size), remaining / (len(tables) - i))
+            remaining -= share
+            limits[model] = max(1, int(share / row_size(size)))
+
+        return limits
+
     def collect_data(self, model_settings, limit=None):
         """
         You can easily add more data by implementing get_custom_data
         """
+        self.budget = self.get_budget()
+
+        # the sampled rows take precedence, so their share of the budget is
+        # held back while the custom data follow their reverse dependencies
+        for model, model_limit in model_settings[:limit]:
+            self.budget.spend(model, model_limit)
+
         # first add the data we are manually specifying
         logger.info("loading the custom data first")
         custom_data, fetched_pks = self.get_custom_data()
 
-        models = set(map(itemgetter(0), model_settings))
+        for model, model_limit in model_settings[:limit]:
+            self.budget.release(model, model_limit)
 
-        for obj in custom_data.keys():
-            if obj in models:
-                model_settings = list(filter(lambda x: x[0] != obj, model_settings))
-                logger.info(
-                    "skipping already collected data for custom model %s",
-                    model_name(obj),
-                )
-
-        objects = list(chain.from_iterable(custom_data.values()))
+        model_settings = self.skip_custom_models(model_settings, custom_data.keys())
         dependencies = defaultdict(list)
+        resolver = self.get_resolver(dependencies, fetched_pks, stream=self.stream)
+
+        requests = []
 
         for model, limit in model_settings[:limit]:
             logger.info("getting %s items for model %s", limit, model_name(model))
-            queryset = model._default_manager.order_by("-pk")[:limit]
-            objects.extend(queryset)
-            self._fetch_forward_dependencies(model, queryset, dependencies, fetched_pks)
+            requests.extend(self.get_sample_requests(model, limit))
 
-        objects.extend(list(chain.from_iterable(dependencies.values())))
+        resolver.fetch_many(requests)
+        resolver.run()
+        objects = CollectedData(chain.from_iterable(custom_data.values()))
+
+        for instances in dependencies.values():
+            if isinstance(instances, InstanceStream):
+                objects.add_stream(instances)
+            else:
+                objects.extend(instances)
 
         return objects
 
-    def _fetch_forward_dependencies(self, model, qs, result, fetched_pks):
-        for dependency, attr in self.forward_mapping.get(model, []):
-            if self.exclude_content_type and isinstance(
-                dependency, (ContentType, Permission)
-            ):
-                continue
+    def collect_delta(self, model_settings, manifest, limit=None):
+        """
+        Collects the rows that are new or changed since the snapshot of the
+        manifest, returns them with the Manifest of the delta
+
+        The rows of the manifest are fetched again by pk and compared with their
+        hashes, the changed ones are replaced and the missing ones deleted. The
+        samples are taken again, but only their new rows and the dependencies
+        not exported yet are collected. The custom data are not collected again,
+        only the rows they added to the previous snapshot are refreshed. The
+        rows add_extra_data adds are kept when they are new, see
+        add_delta_extra_data.
+        """
+        self.budget = self.get_budget()
+        fetched_pks = defaultdict(PkSet)
+        dependencies = defaultdict(list)
+        resolver = self.get_resolver(dependencies, fetched_pks)
 
-            logger.info(
-                "fetching dependency %s -> %s",
-                model_name(model),
-                model_name(dependency),
-            )
+        for model, hashes in manifest.rows.items():
+            fetched_pks[model].update(hashes)
 
-            if isinstance(model._meta.get_field(attr), ManyToManyField):
-                qs_new = dependency._base_manager.none()
+        changed, deleted = self.get_changed_rows(manifest)
+        model_settings = self.skip_custom_models(
+            model_settings, self.get_custom_models()
+        )
 
-                try:
-                    qs = qs.prefetch_related(attr)
-                except NotSupportedError:
-                    pass
+        for model, instances in changed.items():
+            logger.info("%d rows of %s changed", len(instances), model_name(model))
+            dependencies[model].extend(instances)
+            resolver.add(model, instances)
 
-                for q in qs:
-                    qs_new = qs_new.union(
-                        getattr(q, attr)
-                        .exclude(pk__in=fetched_pks[dependency])
-                        .order_by()
-                    )
-            else:
-                qs_new = dependency._base_manager.filter(
-                    pk__in=tuple(map(attrgetter(attr + "_id"), qs))
-                ).exclude(pk__in=fetched_pks[dependency])
+        requests = []
 
-            if qs_new:
-                result[dependency].extend(list(qs_new))
-                fetched_pks[dependency].update(set(map(attrgetter("pk"), qs_new)))
+        for model, model_limit in model_settings[:limit]:
+            requests.extend(self.get_sample_requests(model, model_limit))
 
-                if dependency in self.forward_mapping:
-                    self._fetch_forward_dependencies(
-                        dependency, qs_new, result, fetched_pks
-                    )
+        resolver.fetch_many(requests)
+        resolver.run()
+        objects = CollectedData(chain.from_iterable(dependencies.values()))
+        objects = self.add_delta_extra_data(objects, manifest)
+        replaced = {
+            model: set(map(attrgetter("pk"), x)) for model, x in changed.items()
+        }
 
-    def _fetch_reverse_dependencies(self, model, qs, result, fetched_pks):
-        self._fetch_forward_dependencies(model, qs, result, fetched_pks)
+        return objects, manifest.updated(
+            objects, deleted, replaced, batch_size=self.batch_size
+        )
 
-        for dependency, attr in self.reverse_mapping.get(model, []):
-            logger.info(
-                "fetching dependency %s <- %s",
-                model_name(model),
-                model_name(dependency),
-            )
-            qs_new = dependency._base_manager.filter(**{attr + "__in": qs}).exclude(
-                pk__in=fetched_pks[dependency]
-            )[
-                : max(
-                    0,
-                    self.model_settings.get(dependency, DEFAULT_LIMIT)
-                    - len(fetched_pks[dependency]),
+    def add_delta_extra_data(self, objects, manifest):
+        """
+        Runs add_extra_data on the delta objects, and adds the extra rows the
+        manifest does not list, the changed ones being already in the delta
+        """
+        data = self.add_extra_data(objects.copy())
+
+        for instance in data:
+            model = type(instance)._meta.concrete_model
+
+            if instance.pk not in manifest.rows.get(model, ()):
+                objects.append(instance)
+
+        return objects
+
+    def skip_custom_models(self, model_settings, custom_models):
+        """
+        The model settings without the models of the custom data, which are
+        collected by get_custom_data rather than sampled
+        """
+        models = set(map(itemgetter(0), model_settings))
+
+        for obj in custom_models:
+            if obj in models:
+                model_settings = list(filter(lambda x: x[0] != obj, model_settings))
+                logger.info(
+                    "skipping already collected data for custom model %s",
+                    model_name(obj),
                 )
+
+        return model_settings
+
+    def get_changed_rows(self, manifest):
+        """
+        Fetches the rows of the manifest by pk, returns the changed instances
+        and the pks of the deleted rows of every model
+        """
+        models, querysets = [], []
+
+        for model, hashes in sorted(
+            manifest.rows.items(), key=lambda x: model_name(x[0])
+        ):
+            for chunk in chunked(sorted(hashes, key=str), self.batch_size):
+                models.append(model)
+                querysets.append(model._base_manager.filter(pk__in=chunk))
+
+        pool = WorkerPool(self.workers)
+        instances = defaultdict(list)
+
+        try:
+            for model, chunk in zip(models, pool.map(list, querysets)):
+                instances[model].extend(chunk)
+        finally:
+            pool.close()
+
+        changed, deleted = {}, {}
+
+        for model, hashes in manifest.rows.items():
+            current = row_hashes(model, instances[model], self.batch_size)
+            changed[model] = [
+                x for x in instances[model] if current[x.pk] != hashes[x.pk]
             ]
+            deleted[model] = set(hashes) - set(current)
+
+        return (
+            {model: x for model, x in changed.items() if x},
+            {model: x for model, x in deleted.items() if x},
+        )
+
+    def get_resolver(self, result, fetched_pks, stream=False):
+        return DependencyResolver(
+            self,
+            result,
+            fetched_pks,
+            pks_only=self.resolve_pks_only,
+            workers=self.workers,
+            budget=self.budget,
+            profiler=self.profiler,
+            stream=stream,
+        )
+
+    def get_budget(self):
+        row_bytes = {}
+
+        if self.max_bytes is not None:
+            row_bytes = {
+                model: size.bytes / size.rows
+                for model, size in self.table_sizes.items()
+                if size.rows and size.bytes
+            }
+
+        return Budget(self.max_rows, self.max_bytes, row_bytes)
+
+    def get_limit(self, model):
+        return self.model_settings.get(model, DEFAULT_LIMIT)
 
-            if qs_new:
-                result[dependency].extend(list(qs_new))
-                fetched_pks[dependency].update(set(map(attrgetter("pk"), qs_new)))
+    def _fetch_forward_dependencies(self, model, qs, result, fetched_pks):
+        resolver = self.get_resolver(result, fetched_pks)
+        resolver.add(model, qs)
+        resolver.run()
 
-                if dependency in self.reverse_mapping:
-                    self._fetch_reverse_dependencies(
-                        dependency, qs_new, result, fetched_pks
-                    )
-                elif dependency in self.forward_mapping:
-                    self._fetch_forward_dependencies(
-                        dependency, qs_new, result, fetched_pks
-                    )
+    def _fetch_reverse_dependencies(self, model, qs, result, fetched_pks):
+        resolver = self.get_resolver(result, fetched_pks)
+        resolver.add(model, qs, reverse=True)
+        resolver.run()
 
-    @cached(key="cached_model_settings", timeout=60 * 10)
     def get_cached_model_settings(self):
-        return self.get_model_settings()
+        """
+        The model settings, and the table sizes they are computed from, are
+        kept in a DiskCache for cache_timeout seconds, so the repeated runs
+        skip the sizing queries
+        """
+        key = self.get_cache_key()
+        cached = self.cache.get(key)
+
+        if cached is not None:
+            logger.info("using the cached model settings")
+            get_model = django.apps.apps.get_model
+            self.table_sizes = {
+                get_model(x): TableSize(*y) for x, y in cached["table_sizes"]
+            }
+            return [(get_model(x), y) for x, y in cached["model_settings"]]
+
+        model_settings = self.get_model_settings()
+        cached = {
+            "model_settings": [(model_name(x), y) for x, y in model_settings],
+            "table_sizes": [(model_name(x), y) for x, y in self.table_sizes.items()],
+        }
+        self.cache.set(key, cached, self.cache_timeout)
+        return model_settings
+
+    def get_cache_key(self):
+        """
+        The model settings depend on the database, its schema and the creator
+        """
+        creator_class = type(self)
+        return ":".join(
+            map(
+                str,
+                [
+                    "model_settings",
+                    connection.alias,
+                    connection.settings_dict["NAME"],
+                    connection.settings_dict["HOST"],
+                    schema_hash(self.models),
+                    creator_class.__module__ + "." + creator_class.__qualname__,
+                    self.target_rows,
+                    self.target_bytes,
+                ],
+            )
+        )
+
+    def clear_cache(self):
+        self.cache.delete(self.get_cache_key())
 
     def get_full_required(self):
         return set()
@@ -244,19 +675,27 @@ class DevDBCreator:
         logger.info("loading staff users")
         user_model = get_user_model()
         qs = user_model._default_manager.filter(is_staff=True)[
-            : self.model_settings.get(user_model, DEFAULT_LIMIT)
+            : self.get_limit(user_model)
         ]
 
         custom_data = self._init_custom_data(user_model)
         custom_data[user_model].extend(list(qs))
 
-        fetched_pks = defaultdict(set)
-        fetched_pks[user_model].update(set(map(attrgetter("pk"), qs)))
+        fetched_pks = defaultdict(PkSet)
+        fetched_pks[user_model].update(map(attrgetter("pk"), qs))
 
         self._fetch_reverse_dependencies(user_model, qs, custom_data, fetched_pks)
 
         return custom_data, fetched_pks
 
+    def get_custom_models(self):
+        """
+        The models of get_custom_data, without collecting them, replace it
+        along with get_custom_data
+        """
+        user_model = get_user_model()
+        return {user_model, *self._init_custom_data(user_model)}
+
     def _init_custom_data(self, model, custom_data=None):
         if custom_data is None:
             custom_data = defaultdict(list)
@@ -268,13 +707,72 @@ class DevDBCreator:
 
         return custom_data
 
+    def order_data(self, data):
+        """
+        Yields the instances table by table, every table after the tables it
+        references, and the rows of a self referencing table parents first, so
+        the fixture can be loaded with the constraints checked as it goes
+
+        The tables referencing each other in a cycle cannot be ordered, their
+        rows still need deferred constraint checks.
+        """
+        tables = self.filter_data(data).tables()
+        groups = [
+            x
+            for level in dependency_levels(tables, self.dependency_graph)
+            for x in level
+        ]
+
+        for group in groups:
+            if len(group) > 1:
+                logger.warning(
+                    "the tables of %s reference each other, their rows cannot "
+                    "be ordered",
+                    ", ".join(map(model_name, group)),
+                )
+
+        for model in chain.from_iterable(groups):
+            instances, streams = tables[model]
+            fields = self_references(model)
+
+            if fields:
+                instances = self._parent_first(instances, fields)
+
+                for stream in streams:
+                    stream.order = self._stream_parent_first(stream, fields)
+
+            yield from instances
+
+            for stream in streams:
+                yield from stream
+
+    def _parent_first(self, instances, fields):
+        rows = [(x.pk, *(getattr(x, f.attname) for f in fields)) for x in instances]
+        instances = {x.pk: x for x in instances}
+        return [instances[pk] for pk in parent_first(rows)]
+
+    def _stream_parent_first(self, stream, fields):
+        """
+        The pks of the stream parents first, only their foreign keys are
+        selected
+        """
+        rows = []
+        columns = ["pk"] + [x.attname for x in fields]
+
+        for chunk in chunked(stream.pks, self.batch_size):
+            queryset = stream.model._base_manager.filter(pk__in=chunk)
+            rows.extend(queryset.order_by("pk").values_list(*columns))
+
+        return parent_first(rows)
+
     def filter_data(self, data):
+        """
+        The collected data never hold duplicates, see CollectedData, only the
+        data of another type, e.g. a new list built by add_extra_data, need to
+        be filtered
+        """
+        if isinstance(data, CollectedData):
+            return data
+
         logger.info("filtering data to unique instances")
-        unique_set = set()
-        filtered_data = []
-        for instance in data:
-            h = hash_instance(instance)
-            if h not in unique_set:
-                unique_set.add(h)
-                filtered_data.append(instance)
-        return filtered_data
+        return CollectedData(data)
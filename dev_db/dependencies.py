@@ -1,8 +1,15 @@
-from collections import defaultdict
+from collections import defaultdict, deque
+import hashlib
+import json
+import logging
 
+from django.apps import apps
 from django.db.models.fields.related import ForeignKey, ManyToManyField, OneToOneField
 
-from dev_db.utils import get_all_fields
+from dev_db.utils import get_all_fields, get_cache_dir, model_name
+
+logger = logging.getLogger(__name__)
+GRAPH_VERSION = 1
 
 
 def get_dependency_mapping(models):
@@ -35,3 +42,370 @@ def _mapping_for_model(model, mapping, visited):
 
             if field.related_model not in visited:
                 _mapping_for_model(field.related_model, mapping, visited)
+
+
+class DependencyGraph:
+    """
+    The dependency mapping of a set of models, compiled to arrays
+
+    The models are numbered in the order of their labels, and the edges of
+    every model are tuples of (model id, attribute) sorted the same way:
+
+    - forward[i]: the models referenced by the model i, through the attribute
+      of the model i
+    - reverse[i]: the models referencing the model i, through their attribute
+
+    components holds the strongly connected components, in topological order:
+    a component only references itself and the components before it. Most are
+    single models, the others are dependency cycles, see cycles. order is the
+    resulting topological order of the model ids.
+
+    The graph is built from get_dependency_mapping, so it also holds the models
+    the given ones reference, and is saved to the cache directory, keyed by a
+    hash of the relations of the models, see get_dependency_graph.
+    """
+
+    def __init__(self, models, forward, components):
+        self.models = tuple(models)
+        self.ids = {model: i for i, model in enumerate(self.models)}
+        self.forward = tuple(tuple(map(tuple, x)) for x in forward)
+        self.components = tuple(map(tuple, components))
+        reverse = [[] for _ in self.models]
+
+        for i, edges in enumerate(self.forward):
+            for j, attr in edges:
+                reverse[j].append((i, attr))
+
+        self.reverse = tuple(tuple(sorted(x)) for x in reverse)
+        self.component_of = [0] * len(self.models)
+
+        for c, component in enumerate(self.components):
+            for i in component:
+                self.component_of[i] = c
+
+        self.order = tuple(i for component in self.components for i in component)
+
+    @classmethod
+    def compile(cls, models):
+        mapping = get_dependency_mapping(models)
+        nodes = set(models).union(mapping)
+
+        for dependents in mapping.values():
+            nodes.update(model for model, _ in dependents)
+
+        nodes = sorted(nodes, key=model_name)
+        ids = {model: i for i, model in enumerate(nodes)}
+        forward = [[] for _ in nodes]
+
+        for model, dependents in mapping.items():
+            for dependent, attr in dependents:
+                forward[ids[dependent]].append((ids[model], attr))
+
+        forward = [sorted(x) for x in forward]
+        return cls(nodes, forward, strongly_connected_components(forward))
+
+    def forward_edges(self, model):
+        """
+        The (model, attribute) the model references, sorted by label
+        """
+        return self._edges(self.forward, model)
+
+    def reverse_edges(self, model):
+        """
+        The (model, attribute) referencing the model, sorted by label
+        """
+        return self._edges(self.reverse, model)
+
+    def _edges(self, adjacency, model):
+        i = self.ids.get(model)
+
+        if i is None:
+            return ()
+
+        return tuple((self.models[j], attr) for j, attr in adjacency[i])
+
+    @property
+    def cycles(self):
+        """
+        The components which are dependency cycles, including self references
+        """
+        return [
+            [self.models[i] for i in component]
+            for component in self.components
+            if len(component) > 1
+            or any(j == component[0] for j, _ in self.forward[component[0]])
+        ]
+
+    def mapping(self):
+        """
+        The graph in the format of get_dependency_mapping
+        """
+        mapping = defaultdict(set)
+
+        for i, edges in enumerate(self.reverse):
+            if edges:
+                mapping[self.models[i]].update(
+                    (self.models[j], attr) for j, attr in edges
+                )
+
+        return mapping
+
+    def levels(self, models):
+        """
+        Groups the given models in levels, see dependency_levels
+        """
+        present = defaultdict(list)
+
+        for i in sorted(self.ids[x] for x in models):
+            present[self.component_of[i]].append(i)
+
+        pending = {
+            c: {
+                self.component_of[j]
+                for i in ids
+                for j, _ in self.forward[i]
+                if self.component_of[j] in present
+            }
+            - {c}
+            for c, ids in present.items()
+        }
+        levels = []
+
+        while pending:
+            level = sorted(
+                (c for c, waiting in pending.items() if not waiting),
+                key=lambda c: present[c][0],
+            )
+
+            for c in level:
+                del pending[c]
+
+            for waiting in pending.values():
+                waiting.difference_update(level)
+
+            levels.append([[self.models[i] for i in present[c]] for c in level])
+
+        return levels
+
+    def to_json(self, key):
+        return {
+            "version": GRAPH_VERSION,
+            "key": key,
+            "models": [model_name(x) for x in self.models],
+            "forward": self.forward,
+            "components": self.components,
+        }
+
+    @classmethod
+    def from_json(cls, data):
+        return cls(
+            [apps.get_model(x) for x in data["models"]],
+            data["forward"],
+            data["components"],
+        )
+
+
+def strongly_connected_components(adjacency):
+    """
+    The strongly connected components of the graph, in topological order
+
+    An iterative version of Tarjan's algorithm, which finds the components of
+    the referenced nodes first
+    """
+    index, lowlink = {}, {}
+    stack, on_stack, components = [], set(), []
+
+    for root in range(len(adjacency)):
+        if root in index:
+            continue
+
+        work = [(root, 0)]
+
+        while work:
+            node, position = work.pop()
+
+            if position == 0:
+                index[node] = lowlink[node] = len(index)
+                stack.append(node)
+                on_stack.add(node)
+
+            for k in range(position, len(adjacency[node])):
+                successor = adjacency[node][k][0]
+
+                if successor not in index:
+                    work.append((node, k + 1))
+                    work.append((successor, 0))
+                    break
+                elif successor in on_stack:
+                    lowlink[node] = min(lowlink[node], index[successor])
+            else:
+                if lowlink[node] == index[node]:
+                    component = []
+
+                    while True:
+                        member = stack.pop()
+                        on_stack.discard(member)
+                        component.append(member)
+
+                        if member == node:
+                            break
+
+                    components.append(sorted(component))
+
+                if work:
+                    parent = work[-1][0]
+                    lowlink[parent] = min(lowlink[parent], lowlink[node])
+
+    return components
+
+
+def graph_key(models):
+    """
+    Hashes the given models and the relations of all the installed models, so
+    the key changes with any relation the graph could follow
+    """
+    relations = [
+        (
+            model_name(model),
+            sorted(
+                (
+                    (
+                        x.name,
+                        model_name(x.related_model),
+                        model_name(x.remote_field.through),
+                    )
+                    if isinstance(x, ManyToManyField)
+                    else (x.name, model_name(x.related_model))
+                )
+                for x in get_all_fields(model)
+                if isinstance(x, (ForeignKey, OneToOneField, ManyToManyField))
+            ),
+        )
+        for model in apps.get_models(include_auto_created=True)
+    ]
+    data = json.dumps(
+        [sorted(map(model_name, models)), sorted(relations)], default=str
+    ).encode("utf-8")
+    return hashlib.sha1(data).hexdigest()
+
+
+def get_dependency_graph(models, cache=True):
+    """
+    Returns the DependencyGraph of the models, from the cache directory if the
+    relations of the models did not change
+    """
+    models = list(models)
+
+    if not cache:
+        return DependencyGraph.compile(models)
+
+    key = graph_key(models)
+    path = get_cache_dir() / ("graph-%s.json" % key)
+
+    try:
+        with open(path, encoding="utf-8") as f:
+            data = json.load(f)
+
+        if data["version"] == GRAPH_VERSION and data["key"] == key:
+            return DependencyGraph.from_json(data)
+    except (OSError, ValueError, KeyError, LookupError) as e:
+        logger.debug("compiling the dependency graph: %s", e)
+
+    graph = DependencyGraph.compile(models)
+
+    try:
+        path.parent.mkdir(parents=True, exist_ok=True)
+
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(graph.to_json(key), f)
+    except OSError as e:
+        logger.warning("cannot save the dependency graph: %s", e)
+
+    return graph
+
+
+def dependency_levels(models, graph=None):
+    """
+    Groups the models in levels, the models of a level only referencing models
+    of the previous levels
+
+    Every level is a list of groups, a group being either a single model or the
+    models of a dependency cycle, which have to be loaded together. The levels,
+    groups and models are sorted by label so the result is deterministic.
+    graph is a DependencyGraph holding the models, by default or when it lacks
+    some of them, the one of get_dependency_graph.
+    """
+    models = list(models)
+
+    if graph is None or any(x not in graph.ids for x in models):
+        graph = get_dependency_graph(models)
+
+    return graph.levels(models)
+
+
+def dependency_order(models):
+    """
+    Sorts the models so that every model comes after the models it references
+
+    The models of a dependency cycle are added in alphabetical order
+    """
+    return [
+        model
+        for level in dependency_levels(models)
+        for group in level
+        for model in group
+    ]
+
+
+def self_references(model):
+    """
+    The foreign keys of the model referencing the model itself
+    """
+    return [
+        x
+        for x in model._meta.concrete_fields
+        if isinstance(x, (ForeignKey, OneToOneField))
+        and x.related_model._meta.concrete_model is model._meta.concrete_model
+    ]
+
+
+def parent_first(rows):
+    """
+    Orders the (pk, parent pk...) rows of a self referencing table so that every
+    row comes after its parents, returns the pks
+
+    The rows without a parent in the rows keep their order and come first,
+    followed level by level by their descendants. The rows of a cycle, which
+    cannot be ordered, come last.
+    """
+    pks = {row[0] for row in rows}
+    children = defaultdict(list)
+    waiting = {}
+    ready = deque()
+
+    for pk, *parents in rows:
+        parents = {x for x in parents if x in pks and x != pk}
+
+        if parents:
+            waiting[pk] = len(parents)
+
+            for parent in parents:
+                children[parent].append(pk)
+        else:
+            ready.append(pk)
+
+    order = []
+
+    while ready:
+        pk = ready.popleft()
+        order.append(pk)
+
+        for child in children.pop(pk, ()):
+            waiting[child] -= 1
+
+            if not waiting[child]:
+                del waiting[child]
+                ready.append(child)
+
+    order.extend(row[0] for row in rows if row[0] in waiting)
+    return order
@@ -0,0 +1,141 @@
+"""
+Estimation of the table sizes, used to size the samples
+
+Every estimator answers for all the tables with a single query, reading the
+planner statistics of the database when they are available.
+"""
+from collections import namedtuple
+import logging
+
+from dev_db.utils import chunked
+
+logger = logging.getLogger(__name__)
+
+TableSize = namedtuple("TableSize", ["rows", "bytes"])
+# assumed size of a row when the database does not tell
+DEFAULT_ROW_BYTES = 256
+
+
+class TableSizeEstimator:
+    """
+    Counts the rows of all the tables with UNION ALL queries
+
+    This is the fallback for the databases without usable statistics, and for
+    the tables the statistics do not cover
+    """
+
+    def __init__(self, connection):
+        self.connection = connection
+
+    def estimate(self, models):
+        """
+        Returns a {model: TableSize} dict, the bytes are None when unknown
+        """
+        tables = {model._meta.db_table: model for model in models}
+        sizes = {}
+
+        if tables:
+            for table, rows, size in self.get_statistics(sorted(tables)):
+                if table in tables and rows is not None and rows >= 0:
+                    sizes[tables.pop(table)] = TableSize(int(rows), size)
+
+        if tables:
+            for table, rows, size in self.count(sorted(tables)):
+                sizes[tables[table]] = TableSize(int(rows), size)
+
+        return sizes
+
+    def get_statistics(self, tables):
+        """
+        Returns (table, rows, bytes) rows from the database statistics
+        """
+        return []
+
+    def count(self, tables):
+        quote_name = self.connection.ops.quote_name
+        counts = []
+
+        # stay well below the compound select limit of sqlite
+        for chunk in chunked(tables, 100):
+            sql = " UNION ALL ".join(
+                "SELECT %d, COUNT(*) FROM %s" % (i, quote_name(table))
+                for i, table in enumerate(chunk)
+            )
+            counts.extend((chunk[i], rows, None) for i, rows in self.execute(sql, []))
+
+        return counts
+
+    def execute(self, sql, params):
+        with self.connection.cursor() as cursor:
+            cursor.execute(sql, params)
+            return cursor.fetchall()
+
+
+class PostgreSQLTableSizeEstimator(TableSizeEstimator):
+    """
+    Reads reltuples from pg_class, it is -1 for the tables never analyzed
+    """
+
+    def get_statistics(self, tables):
+        return self.execute(
+            """
+            SELECT c.relname, c.reltuples, pg_relation_size(c.oid)
+            FROM pg_class c
+            WHERE c.relkind IN ('r', 'p')
+                AND c.relname = ANY(%s)
+                AND pg_table_is_visible(c.oid)
+            """,
+            [tables],
+        )
+
+
+class MySQLTableSizeEstimator(TableSizeEstimator):
+    def get_statistics(self, tables):
+        return self.execute(
+            """
+            SELECT TABLE_NAME, TABLE_ROWS, DATA_LENGTH
+            FROM information_schema.TABLES
+            WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME IN (%s)
+            """
+            % ", ".join(["%s"] * len(tables)),
+            tables,
+        )
+
+
+class SQLiteTableSizeEstimator(TableSizeEstimator):
+    """
+    Reads sqlite_stat1, which only exists once ANALYZE has been run
+
+    The first number of the stat column is the number of rows of the table.
+    """
+
+    def get_statistics(self, tables):
+        if not self.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = %s",
+            ["sqlite_stat1"],
+        ):
+            logger.info("no sqlite statistics, counting the rows instead")
+            return []
+
+        return self.execute(
+            """
+            SELECT tbl, MAX(CAST(stat AS INTEGER)), NULL
+            FROM sqlite_stat1
+            WHERE tbl IN (%s)
+            GROUP BY tbl
+            """
+            % ", ".join(["%s"] * len(tables)),
+            tables,
+        )
+
+
+ESTIMATORS = {
+    "postgresql": PostgreSQLTableSizeEstimator,
+    "mysql": MySQLTableSizeEstimator,
+    "sqlite": SQLiteTableSizeEstimator,
+}
+
+
+def get_estimator(connection):
+    estimator_class = ESTIMATORS.get(connection.vendor, TableSizeEstimator)
+    return estimator_class(connection)
@@ -0,0 +1,332 @@
+"""
+Reading and writing of the fixture files
+"""
+
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+import gzip
+import importlib
+import io
+import json
+import pickle
+import tempfile
+from pathlib import Path
+
+from django.apps import apps
+from django.core.exceptions import ImproperlyConfigured
+from django.core import serializers
+from django.core.serializers.base import DeserializationError
+
+from dev_db import columnar
+
+# size of the blocks read from the fixture while parsing it
+READ_SIZE = 64 * 1024
+# size of the uncompressed blocks of the ParallelGzipWriter
+GZIP_BLOCK_SIZE = 1024 * 1024
+
+
+def open_fixture(path, mode="r", level=None, threads=1):
+    """
+    Opens the fixture file as a text stream, (de)compressing it based on the
+    suffix: .gz, .zst or .lz4
+
+    level is the compression level, the default one of the library if None.
+    With several threads, .gz fixtures are written by a ParallelGzipWriter and
+    .zst fixtures by the threads of zstandard.
+    """
+    suffix = path.suffix.lower()
+
+    if suffix == ".gz":
+        if mode == "w" and threads > 1:
+            stream = ParallelGzipWriter(open(path, "wb"), level=level, threads=threads)
+            return io.TextIOWrapper(io.BufferedWriter(stream), encoding="utf-8")
+
+        return gzip.open(
+            path,
+            mode + "t",
+            compresslevel=9 if level is None else level,
+            encoding="utf-8",
+        )
+    elif suffix == ".zst":
+        zstandard = import_compression("zstandard", suffix)
+
+        if mode == "w":
+            compressor = zstandard.ZstdCompressor(
+                level=3 if level is None else level,
+                threads=threads if threads > 1 else 0,
+            )
+            stream = compressor.stream_writer(open(path, "wb"), closefd=True)
+        else:
+            stream = zstandard.ZstdDecompressor().stream_reader(
+                open(path, "rb"), closefd=True
+            )
+
+        return io.TextIOWrapper(stream, encoding="utf-8")
+    elif suffix == ".lz4":
+        lz4_frame = import_compression("lz4.frame", suffix)
+        options = {"compression_level": level} if level is not None else {}
+        return lz4_frame.open(path, mode + "t", encoding="utf-8", **options)
+
+    return open(path, mode, encoding="utf-8")
+
+
+def import_compression(module, suffix):
+    """
+    Imports the optional library (de)compressing the fixtures with the suffix
+    """
+    try:
+        return importlib.import_module(module)
+    except ImportError as e:
+        raise ImproperlyConfigured(
+            'The %s package is required for %s fixtures: "%s"'
+            % (module.split(".")[0], suffix, e)
+        )
+
+
+class ParallelGzipWriter(io.RawIOBase):
+    """
+    Compresses blocks of the stream concurrently, each as its own gzip member
+
+    A file made of several gzip members is still a valid gzip file, which
+    gunzip and the gzip module decompress as a whole. zlib releases the GIL
+    while compressing, so the blocks are compressed by several cores. At most
+    2 * threads blocks are held in memory.
+    """
+
+    def __init__(self, stream, level=None, threads=2, block_size=GZIP_BLOCK_SIZE):
+        self.stream = stream
+        self.level = 9 if level is None else level
+        self.threads = threads
+        self.block_size = block_size
+        self.executor = ThreadPoolExecutor(threads)
+        self.buffer = bytearray()
+        self.pending = deque()
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self.buffer += data
+
+        while len(self.buffer) >= self.block_size:
+            self.submit(bytes(self.buffer[: self.block_size]))
+            del self.buffer[: self.block_size]
+
+        return len(data)
+
+    def submit(self, block):
+        self.pending.append(self.executor.submit(gzip.compress, block, self.level))
+
+        while len(self.pending) > 2 * self.threads:
+            self.stream.write(self.pending.popleft().result())
+
+    def close(self):
+        if self.closed:
+            return
+
+        try:
+            if self.buffer:
+                self.submit(bytes(self.buffer))
+                self.buffer.clear()
+
+            while self.pending:
+                self.stream.write(self.pending.popleft().result())
+        finally:
+            self.executor.shutdown()
+            self.stream.close()
+            super().close()
+
+
+def write_fixture(
+    path,
+    format,
+    objects,
+    compression_level=None,
+    threads=1,
+    profiler=None,
+    **options,
+):
+    """
+    Serializes the objects straight into the fixture file
+
+    The serializer writes every instance to the stream as soon as it is
+    processed, so neither the serialized string nor its encoded copy is ever
+    built in memory. objects can be any iterable, including a generator.
+
+    The devdb format is dev_db specific, see dev_db.columnar, it ignores the
+    options of the Django serializers. compression_level and threads are
+    passed to open_fixture, or to the zlib compression of the devdb chunks.
+    With a profiler, the serialization time and the size written of every
+    model are recorded, before the compression for the Django formats and
+    after it, per chunk, for the devdb format.
+    """
+    if profiler is not None:
+        objects = profiler.serialized(objects)
+
+    if format == columnar.FORMAT:
+        level = columnar.LEVEL if compression_level is None else compression_level
+
+        with open(path, "wb") as stream:
+            columnar.ColumnarWriter(stream, level=level, profiler=profiler).write(
+                objects
+            )
+        return
+
+    serializer = serializers.get_serializer(format)()
+
+    with open_fixture(path, "w", compression_level, threads) as stream:
+        if profiler is not None:
+            stream = profiler.counting(stream)
+
+        serializer.serialize(objects, stream=stream, **options)
+
+
+def fixture_format(path):
+    """
+    Guesses the serialization format from the first suffix of the file name
+    """
+    return path.suffixes[0][1:].lower() if path.suffixes else "json"
+
+
+def read_fixture(path, format=None, ignorenonexistent=False):
+    """
+    Yields the deserialized objects of the fixture file
+
+    The json deserializer of Django reads the whole file before yielding the
+    first object, so json fixtures are parsed incrementally instead, keeping
+    only one block of the file in memory. jsonl fixtures are read line by line.
+    Like loaddata, the fields and models of the fixture missing from the
+    project raise an error, unless ignorenonexistent.
+    """
+    format = format or fixture_format(path)
+
+    if format == columnar.FORMAT:
+        with open(path, "rb") as stream:
+            yield from columnar.ColumnarReader(stream, ignorenonexistent)
+        return
+
+    with open_fixture(path) as stream:
+        if format == "json":
+            yield from serializers.deserialize(
+                "python", iter_json_array(stream), ignorenonexistent=ignorenonexistent
+            )
+        else:
+            yield from serializers.deserialize(
+                format, stream, ignorenonexistent=ignorenonexistent
+            )
+
+
+@contextmanager
+def fixture_tables(path, format=None, ignorenonexistent=False):
+    """
+    Maps every model of the fixture file to a function yielding its objects
+
+    The tables of a devdb fixture are read straight from the file. The objects
+    of the other formats are spooled to one temporary file per model, so the
+    tables can be read independently, by several threads, in constant memory.
+    """
+    format = format or fixture_format(path)
+
+    if format == columnar.FORMAT:
+        with open(path, "rb") as stream:
+            reader = columnar.ColumnarReader(stream, ignorenonexistent)
+            tables = {reader.get_model(x): x for x in reader.header["tables"]}
+
+        yield {
+            model: _table_reader(path, x, ignorenonexistent)
+            for model, x in tables.items()
+            if model is not None
+        }
+        return
+
+    with tempfile.TemporaryDirectory() as directory:
+        paths, files = {}, {}
+
+        try:
+            for obj in read_fixture(path, format, ignorenonexistent):
+                model = type(obj.object)
+
+                if model not in files:
+                    paths[model] = Path(directory) / model._meta.label_lower
+                    files[model] = open(paths[model], "wb")
+
+                pickle.dump(obj, files[model], pickle.HIGHEST_PROTOCOL)
+        finally:
+            for stream in files.values():
+                stream.close()
+
+        yield {model: _spool_reader(x) for model, x in paths.items()}
+
+
+def _table_reader(path, table, ignorenonexistent=False):
+    def read():
+        with open(path, "rb") as stream:
+            reader = columnar.ColumnarReader(stream, ignorenonexistent)
+            yield from reader.read_table(table)
+
+    return read
+
+
+def _spool_reader(path):
+    def read():
+        with open(path, "rb") as stream:
+            while True:
+                try:
+                    yield pickle.load(stream)
+                except EOFError:
+                    return
+
+    return read
+
+
+def iter_json_array(stream, read_size=READ_SIZE):
+    """
+    Yields the items of the JSON array read from the text stream, one by one
+    """
+    decoder = json.JSONDecoder()
+    whitespace = json.decoder.WHITESPACE.match
+    buffer, position, started = "", 0, False
+
+    while True:
+        block = stream.read(read_size)
+        buffer = buffer[position:] + block
+        position = 0
+
+        while True:
+            position = whitespace(buffer, position).end()
+
+            if position == len(buffer):
+                break
+
+            if not started:
+                if buffer[position] != "[":
+                    raise DeserializationError("The fixture is not a JSON array")
+                started = True
+                position += 1
+                continue
+
+            if buffer[position] == "]":
+                return
+
+            if buffer[position] == ",":
+                position += 1
+                continue
+
+            try:
+                item, end = decoder.raw_decode(buffer, position)
+            except json.JSONDecodeError as e:
+                if not block:
+                    raise DeserializationError(e) from e
+                # the item continues in the next block
+                break
+
+            if end == len(buffer) and block:
+                # a number may continue in the next block
+                break
+
+            position = end
+            yield item
+
+        if not block:
+            raise DeserializationError("Unexpected end of the fixture")
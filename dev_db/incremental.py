@@ -0,0 +1,191 @@
+"""
+Manifests of the exported rows, for incremental snapshots
+
+A manifest is written next to the fixture, as <fixture>.manifest.json. It maps
+every model to the pks of its exported rows and a hash of their values, so a
+later run of create_dev_db --since only exports the rows that are new or that
+changed since. The manifest of such a delta fixture also lists the rows the
+delta deletes and the rows it replaces, which load_dev_db --delta removes
+before inserting the delta on top of the existing database.
+"""
+from collections import defaultdict
+import hashlib
+import json
+
+from django.apps import apps
+
+from dev_db.columnar import get_fields, m2m_targets
+from dev_db.utils import chunked, model_name
+
+VERSION = 1
+DEFAULT_HASH_BATCH_SIZE = 500
+
+
+def manifest_path(fixture_path):
+    return fixture_path.with_name(fixture_path.name + ".manifest.json")
+
+
+class Manifest:
+    """
+    The pks and row hashes of a snapshot, {model: {pk: hash}}
+
+    For a delta, deleted and replaced map the models to the pks of the rows the
+    delta deletes and replaces. rows always describes the whole snapshot, the
+    previous one with the delta applied, so the deltas can be chained.
+    """
+
+    def __init__(self, rows=None, deleted=None, replaced=None):
+        self.rows = rows or {}
+        self.deleted = deleted or {}
+        self.replaced = replaced or {}
+
+    @property
+    def is_delta(self):
+        return bool(self.deleted or self.replaced)
+
+    @classmethod
+    def from_objects(cls, objects, batch_size=DEFAULT_HASH_BATCH_SIZE):
+        return cls().updated(objects, batch_size=batch_size)
+
+    def updated(self, objects, deleted=None, replaced=None, batch_size=None):
+        """
+        The manifest of the snapshot with the objects added or replaced and the
+        deleted rows removed
+        """
+        rows = {model: dict(hashes) for model, hashes in self.rows.items()}
+        deleted = deleted or {}
+
+        for model, pks in deleted.items():
+            for pk in pks:
+                rows[model].pop(pk, None)
+
+        for model, hashes in hash_objects(objects, batch_size).items():
+            rows.setdefault(model, {}).update(hashes)
+
+        return Manifest(rows, deleted, replaced)
+
+    def save(self, path):
+        def dump(mapping):
+            return {
+                model_name(model): sorted(x, key=str) for model, x in mapping.items()
+            }
+
+        data = {
+            "version": VERSION,
+            "rows": {
+                model_name(model): sorted(hashes.items(), key=lambda x: str(x[0]))
+                for model, hashes in self.rows.items()
+            },
+            "deleted": dump(self.deleted),
+            "replaced": dump(self.replaced),
+        }
+
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(data, f, cls=PkEncoder)
+
+    @classmethod
+    def load(cls, path):
+        with open(path, encoding="utf-8") as f:
+            data = json.load(f)
+
+        if data["version"] != VERSION:
+            raise ValueError("Unsupported manifest version %s" % data["version"])
+
+        def load_pks(model, pks):
+            return {model._meta.pk.to_python(x) for x in pks}
+
+        return cls(
+            {
+                model: {model._meta.pk.to_python(pk): x for pk, x in rows}
+                for model, rows in _models(data["rows"])
+            },
+            {model: load_pks(model, x) for model, x in _models(data["deleted"])},
+            {model: load_pks(model, x) for model, x in _models(data["replaced"])},
+        )
+
+
+class PkEncoder(json.JSONEncoder):
+    # pks which are not JSON types (e.g. UUID) are stored as strings
+    def default(self, o):
+        return str(o)
+
+
+def _models(mapping):
+    for label, value in mapping.items():
+        yield apps.get_model(label), value
+
+
+class RowHasher:
+    """
+    Hashes the instances as they are added, batch_size instances of a model at
+    a time, so only the hashes are kept, {model: {pk: hash}}
+    """
+
+    def __init__(self, batch_size=None):
+        self.batch_size = batch_size or DEFAULT_HASH_BATCH_SIZE
+        self.hashes = defaultdict(dict)
+        self.pending = defaultdict(list)
+
+    def track(self, objects):
+        """
+        Hashes the objects while passing them through, e.g. to the serializer
+        """
+        for obj in objects:
+            self.add(obj)
+            yield obj
+
+        self.flush()
+
+    def add(self, obj):
+        model = type(obj)._meta.concrete_model
+        pending = self.pending[model]
+        pending.append(obj)
+
+        if len(pending) >= self.batch_size:
+            self._hash(model, pending)
+
+    def flush(self):
+        for model, pending in self.pending.items():
+            self._hash(model, pending)
+
+    def _hash(self, model, pending):
+        if pending:
+            self.hashes[model].update(row_hashes(model, pending, self.batch_size))
+            pending.clear()
+
+
+def hash_objects(objects, batch_size=None):
+    """
+    Returns {model: {pk: hash}} for the given instances
+    """
+    hasher = RowHasher(batch_size)
+
+    for obj in objects:
+        hasher.add(obj)
+
+    hasher.flush()
+    return dict(hasher.hashes)
+
+
+def row_hashes(model, instances, batch_size=DEFAULT_HASH_BATCH_SIZE):
+    """
+    Hashes the serialized fields of the instances, {pk: hash}
+
+    The many to many fields are part of the hash, their targets being selected
+    with one query on the through table per chunk of batch_size instances
+    """
+    fields, m2m_fields = get_fields(model)
+    hashes = {}
+
+    for chunk in chunked(instances, batch_size):
+        m2m = {x.name: m2m_targets(x, [obj.pk for obj in chunk]) for x in m2m_fields}
+
+        for obj in chunk:
+            values = [x.value_to_string(obj) for x in fields]
+            values.extend(
+                sorted(m2m[x.name].get(obj.pk, ()), key=str) for x in m2m_fields
+            )
+            data = json.dumps(values, cls=PkEncoder).encode("utf-8")
+            hashes[obj.pk] = hashlib.blake2b(data, digest_size=8).hexdigest()
+
+    return hashes
@@ -0,0 +1,445 @@
+"""
+Fast loading of the fixtures, bypassing the row by row saves of loaddata
+"""
+
+from collections import defaultdict
+from contextlib import nullcontext
+import io
+from itertools import groupby
+import json
+import logging
+
+from django.core.management.color import no_style
+from django.db import DEFAULT_DB_ALIAS, connections, transaction
+from django.db.models import JSONField
+
+from dev_db.dependencies import dependency_levels
+from dev_db.profiling import Stats
+from dev_db.utils import WorkerPool, chunked, model_name
+
+logger = logging.getLogger(__name__)
+DEFAULT_LOAD_BATCH_SIZE = 1000
+# number of deserialized objects held in memory before they are inserted
+DEFAULT_BUFFER_SIZE = 10000
+
+
+class BulkLoader:
+    """
+    Inserts the deserialized objects table by table, in batches
+
+    The constraint checks are disabled during the load and run once at the end,
+    then the sequences are reset past the loaded pks. No signals are sent. Like
+    loaddata, the rows already in the database are replaced by the rows of the
+    fixture with the same pks, e.g. the ones created by the migrations.
+    """
+
+    def __init__(
+        self,
+        using=DEFAULT_DB_ALIAS,
+        batch_size=DEFAULT_LOAD_BATCH_SIZE,
+        buffer_size=DEFAULT_BUFFER_SIZE,
+        profiler=None,
+    ):
+        self.using = using
+        self.batch_size = batch_size
+        self.buffer_size = buffer_size
+        self.profiler = profiler
+
+    @property
+    def connection(self):
+        # the connections are per thread, see load_tables
+        return connections[self.using]
+
+    def load(self, objects, ordered=False):
+        """
+        Loads an iterable of DeserializedObject, returns the number of rows
+
+        At most buffer_size objects are held in memory, so a streamed fixture
+        is loaded in constant memory. With ordered, the objects come table by
+        table in dependency order, as create_dev_db writes them, and they are
+        inserted with the constraints checked as usual, see load_ordered.
+        """
+        models = {}
+        count = 0
+
+        if ordered:
+            with transaction.atomic(using=self.using):
+                count = self.load_ordered(objects, models)
+
+            self.reset_sequences(models)
+            return count
+
+        with transaction.atomic(using=self.using):
+            with self.constraint_checks_deferred():
+                for buffer in chunked(objects, self.buffer_size):
+                    count += self.load_buffer(buffer, models)
+
+            self.check_constraints(models)
+
+        self.reset_sequences(models)
+        return count
+
+    def load_delta(self, objects, manifest):
+        """
+        Applies a delta fixture on top of the loaded database, returns the
+        number of rows, see dev_db.incremental
+
+        The deleted rows are deleted like Django does, with the rows referencing
+        them. The replaced rows are removed without cascading and inserted again
+        with the new rows, the constraints being checked once they are back.
+        """
+        models = {}
+        count = 0
+
+        with transaction.atomic(using=self.using):
+            for model, pks in manifest.deleted.items():
+                logger.info("deleting %d rows of %s", len(pks), model_name(model))
+
+                for chunk in chunked(sorted(pks, key=str), self.batch_size):
+                    model._base_manager.using(self.using).filter(pk__in=chunk).delete()
+
+            with self.constraint_checks_deferred():
+                for model, pks in manifest.replaced.items():
+                    logger.info("replacing %d rows of %s", len(pks), model_name(model))
+                    self.remove(model, pks)
+
+                for buffer in chunked(objects, self.buffer_size):
+                    count += self.load_buffer(buffer, models)
+
+            self.check_constraints(models)
+
+        self.reset_sequences(models)
+        return count
+
+    def remove(self, model, pks):
+        """
+        Deletes the rows and their many to many rows, without cascading
+        """
+        for chunk in chunked(sorted(pks, key=str), self.batch_size):
+            for field in model._meta.local_many_to_many:
+                through = field.remote_field.through
+
+                if through._meta.auto_created:
+                    through._base_manager.using(self.using).filter(
+                        **{field.m2m_field_name() + "__in": chunk}
+                    )._raw_delete(self.using)
+
+            model._base_manager.using(self.using).filter(pk__in=chunk)._raw_delete(
+                self.using
+            )
+
+    def load_tables(self, tables, jobs=1):
+        """
+        Loads the tables level by level in their dependency order, returns the
+        number of rows
+
+        tables maps every model to a function yielding its DeserializedObject,
+        see dev_db.fixtures.fixture_tables. The tables of a level only reference
+        the tables of the previous levels, so they are loaded concurrently by
+        the jobs, each table in its own transaction on its own connection. The
+        tables of a dependency cycle are loaded together in one transaction.
+        The constraint checks are deferred until the end of every transaction,
+        or disabled and run once all the tables are loaded, but unlike load, a
+        failure leaves the tables of the completed transactions loaded.
+        """
+        pool = WorkerPool(self.get_jobs(jobs))
+        models = {}
+        count = 0
+
+        try:
+            for level in dependency_levels(tables):
+                for group_models, group_count in pool.map(
+                    lambda group: self.load_group(tables, group), level
+                ):
+                    models.update(group_models)
+                    count += group_count
+        finally:
+            pool.close()
+
+        self.check_constraints(models)
+        self.reset_sequences(models)
+        return count
+
+    def get_jobs(self, jobs):
+        """
+        The number of tables loaded concurrently, SQLite allows a single writer
+        so its tables are loaded one by one
+        """
+        if jobs > 1 and self.connection.vendor == "sqlite":
+            logger.warning(
+                "SQLite allows a single writer, loading the tables one by one "
+                "instead of with %d jobs",
+                jobs,
+            )
+            return 1
+
+        return jobs
+
+    def load_group(self, tables, group):
+        """
+        Loads the tables of the group in one transaction, returns their models
+        and number of rows
+        """
+        models = {}
+
+        with transaction.atomic(using=self.using):
+            with self.constraint_checks_deferred():
+                count = sum(
+                    self.load_buffer(buffer, models)
+                    for model in group
+                    for buffer in chunked(tables[model](), self.buffer_size)
+                )
+
+        return models, count
+
+    def load_ordered(self, objects, models):
+        """
+        Inserts the objects table by table, in their order, returns the number
+        of rows
+
+        Every table has to come after the tables it references, and every row
+        after the rows it references, so the constraints are neither disabled
+        nor checked again at the end. The many to many rows of a table are
+        inserted once all its rows are, as they can reference the table itself.
+        """
+        count = 0
+
+        for model, group in groupby(objects, key=lambda x: type(x.object)):
+            m2m_rows = []
+
+            for buffer in chunked(group, self.buffer_size):
+                instances = [x.object for x in buffer]
+                logger.info("loading %d rows of %s", len(instances), model_name(model))
+
+                self.insert_rows(model, instances, models)
+                m2m_rows.extend((x.object.pk, x.m2m_data) for x in buffer if x.m2m_data)
+                count += len(instances)
+
+            count += self.insert_m2m(model, m2m_rows)
+
+        return count
+
+    def load_buffer(self, objects, models):
+        """
+        Inserts the buffered objects table by table, recording their models,
+        see insert_rows
+        """
+        instances = defaultdict(list)
+        m2m_data = defaultdict(list)
+
+        for obj in objects:
+            instances[type(obj.object)].append(obj.object)
+
+            if obj.m2m_data:
+                m2m_data[type(obj.object)].append((obj.object.pk, obj.m2m_data))
+
+        count = 0
+
+        for model, model_instances in instances.items():
+            logger.info(
+                "loading %d rows of %s", len(model_instances), model_name(model)
+            )
+
+            self.insert_rows(model, model_instances, models)
+            count += len(model_instances)
+
+        for model, rows in m2m_data.items():
+            count += self.insert_m2m(model, rows)
+
+        return count
+
+    def insert_rows(self, model, instances, models):
+        """
+        Inserts the instances, replacing the rows with the same pks
+
+        models maps the models loaded so far to whether their table had rows
+        before the load, only then are the rows looked up and removed
+        """
+        if model not in models:
+            models[model] = self.has_rows(model)
+
+        with self.measure(model, "insert") as stats:
+            if models[model]:
+                self.remove(model, [x.pk for x in instances])
+
+            self.insert(model, instances)
+            stats.rows = len(instances)
+
+    def has_rows(self, model):
+        return model._base_manager.using(self.using).exists()
+
+    def insert(self, model, instances, fields=None):
+        # a raw insert, like the saves of loaddata, keeps the auto_now values
+        # of the fixture instead of calling pre_save on the fields
+        fields = fields or self.get_fields(model)
+        manager = model._base_manager.using(self.using)
+
+        for chunk in chunked(instances, self.batch_size):
+            manager._insert(chunk, fields=fields, using=self.using, raw=True)
+
+    def measure(self, model, relation):
+        if self.profiler is None:
+            return nullcontext(Stats())
+
+        return self.profiler.measure(model, relation, using=self.using)
+
+    def get_fields(self, model):
+        return [
+            x
+            for x in model._meta.local_concrete_fields
+            if not getattr(x, "generated", False)
+        ]
+
+    def insert_m2m(self, model, rows):
+        """
+        Inserts the rows of the auto created through tables
+        """
+        through_instances = defaultdict(list)
+
+        for pk, m2m_data in rows:
+            for name, targets in m2m_data.items():
+                field = model._meta.get_field(name)
+                through = field.remote_field.through
+                source = through._meta.get_field(field.m2m_field_name()).attname
+                target = through._meta.get_field(field.m2m_reverse_field_name()).attname
+                through_instances[through].extend(
+                    through(**{source: pk, target: x}) for x in targets
+                )
+
+        for through, instances in through_instances.items():
+            # the pks of the through rows are not serialized
+            fields = [x for x in self.get_fields(through) if not x.primary_key]
+
+            with self.measure(through, "insert") as stats:
+                self.insert(through, instances, fields)
+                stats.rows = len(instances)
+
+        return sum(map(len, through_instances.values()))
+
+    def constraint_checks_deferred(self):
+        return self.connection.constraint_checks_disabled()
+
+    def check_constraints(self, models):
+        self.connection.check_constraints(
+            table_names=[model._meta.db_table for model in models]
+        )
+
+    def reset_sequences(self, models):
+        statements = self.connection.ops.sequence_reset_sql(no_style(), list(models))
+
+        if statements:
+            with self.connection.cursor() as cursor:
+                for sql in statements:
+                    cursor.execute(sql)
+
+
+class PostgreSQLCopyLoader(BulkLoader):
+    """
+    Streams the rows with COPY FROM STDIN, in the text format
+
+    The foreign keys Django creates on PostgreSQL are deferrable, so they are
+    deferred until the end of the transaction. Tables with column types the
+    text conversion does not handle (arrays, ranges...) use batched inserts.
+    """
+
+    copyable_types = {
+        "AutoField",
+        "BigAutoField",
+        "BigIntegerField",
+        "BinaryField",
+        "BooleanField",
+        "CharField",
+        "DateField",
+        "DateTimeField",
+        "DecimalField",
+        "DurationField",
+        "EmailField",
+        "FileField",
+        "FilePathField",
+        "FloatField",
+        "ForeignKey",
+        "GenericIPAddressField",
+        "ImageField",
+        "IntegerField",
+        "JSONField",
+        "OneToOneField",
+        "PositiveBigIntegerField",
+        "PositiveIntegerField",
+        "PositiveSmallIntegerField",
+        "SlugField",
+        "SmallAutoField",
+        "SmallIntegerField",
+        "TextField",
+        "TimeField",
+        "URLField",
+        "UUIDField",
+    }
+
+    def insert(self, model, instances, fields=None):
+        fields = fields or self.get_fields(model)
+
+        if any(x.get_internal_type() not in self.copyable_types for x in fields):
+            return super().insert(model, instances, fields)
+
+        quote_name = self.connection.ops.quote_name
+        sql = "COPY %s (%s) FROM STDIN" % (
+            quote_name(model._meta.db_table),
+            ", ".join(quote_name(x.column) for x in fields),
+        )
+
+        with self.connection.cursor() as cursor:
+            for chunk in chunked(instances, self.batch_size):
+                data = "".join(self.copy_row(fields, x) for x in chunk)
+                # through the execute wrappers of the connection, so the COPY
+                # is profiled like the other queries
+                cursor._execute_with_wrappers(sql, data, False, self.copy_executor)
+
+    def copy_executor(self, sql, data, many, context):
+        self.copy(context["cursor"].cursor, sql, data)
+
+    def copy(self, cursor, sql, data):
+        if hasattr(cursor, "copy_expert"):  # psycopg2
+            cursor.copy_expert(sql, io.StringIO(data))
+        else:  # psycopg 3
+            with cursor.copy(sql) as copy:
+                copy.write(data)
+
+    def copy_row(self, fields, instance):
+        return "\t".join(self.copy_value(x, instance) for x in fields) + "\n"
+
+    def copy_value(self, field, instance):
+        value = field.get_prep_value(getattr(instance, field.attname))
+
+        if value is None:
+            return "\\N"
+        elif isinstance(field, JSONField):
+            value = json.dumps(value, cls=field.encoder)
+        elif isinstance(value, bool):
+            value = "t" if value else "f"
+        elif isinstance(value, (bytes, bytearray, memoryview)):
+            value = "\\x" + bytes(value).hex()
+        else:
+            value = str(value)
+
+        return (
+            value.replace("\\", "\\\\")
+            .replace("\t", "\\t")
+            .replace("\n", "\\n")
+            .replace("\r", "\\r")
+        )
+
+    def constraint_checks_deferred(self):
+        with self.connection.cursor() as cursor:
+            cursor.execute("SET CONSTRAINTS ALL DEFERRED")
+
+        return super().constraint_checks_deferred()
+
+    def check_constraints(self, models):
+        # the deferred constraints are checked when the transaction commits
+        pass
+
+
+def get_loader(using=DEFAULT_DB_ALIAS, **kwargs):
+    if connections[using].vendor == "postgresql":
+        return PostgreSQLCopyLoader(using, **kwargs)
+    return BulkLoader(using, **kwargs)
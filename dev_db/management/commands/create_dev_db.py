@@ -8,20 +8,23 @@ optimized tools like pg_dump
 This script follows relations to ensure referential integrity so if you load
 blog_post, it will ensure the author is also serialized
 """
-import gzip
+
 import logging
 from pathlib import Path
 
 from django.core import serializers
-from django.core.cache import cache
 from django.core.management.base import BaseCommand, CommandError
 
-from dev_db.utils import Timer
+from dev_db import columnar
+from dev_db.fixtures import fixture_format, write_fixture
+from dev_db.incremental import Manifest, RowHasher, manifest_path
+from dev_db.profiling import Profiler
 from dev_db.utils import get_creator_instance
 
-
 logger = logging.getLogger(__name__)
 DEBUG = False
+# number of relations in the summary table of --profile
+PROFILE_REPORT_ROWS = 30
 
 
 class Command(BaseCommand):
@@ -32,7 +35,7 @@ class Command(BaseCommand):
             "--format",
             default=None,
             dest="format",
-            help="Specifies the output serialization format for fixtures (default: guess it from the filename)",
+            help="Specifies the output serialization format for fixtures, any Django format or devdb (default: guess it from the filename)",
         )
         parser.add_argument(
             "--indent",
@@ -48,6 +51,41 @@ class Command(BaseCommand):
             type=int,
             help="Allows you to limit the number of tables, used for testing purposes only",
         )
+        parser.add_argument(
+            "--batch-size",
+            default=None,
+            dest="batch_size",
+            type=int,
+            help="Maximum number of pks sent to the database in a single query",
+        )
+        parser.add_argument(
+            "--workers",
+            default=None,
+            dest="workers",
+            type=int,
+            help="Number of threads (and database connections) collecting the data",
+        )
+        parser.add_argument(
+            "--stream",
+            default=False,
+            dest="stream",
+            action="store_true",
+            help="Only keep the pks of the collected rows, and load the instances in chunks while serializing them",
+        )
+        parser.add_argument(
+            "--max-rows",
+            default=None,
+            dest="max_rows",
+            type=int,
+            help="Stop following optional dependencies once this many rows are collected",
+        )
+        parser.add_argument(
+            "--max-bytes",
+            default=None,
+            dest="max_bytes",
+            type=int,
+            help="Stop following optional dependencies once this many bytes are collected (estimated)",
+        )
         parser.add_argument(
             "-o",
             "--output",
@@ -56,6 +94,49 @@ class Command(BaseCommand):
             type=str,
             help="Path of the output file (default: development_data.json.gz)",
         )
+        parser.add_argument(
+            "--compression-level",
+            default=None,
+            dest="compression_level",
+            type=int,
+            help="Compression level of the .gz, .zst, .lz4 and .devdb fixtures (default: the one of the library)",
+        )
+        parser.add_argument(
+            "--compression-threads",
+            default=1,
+            dest="compression_threads",
+            type=int,
+            help="Number of threads compressing the .gz and .zst fixtures (default: 1)",
+        )
+        parser.add_argument(
+            "--manifest",
+            default=False,
+            dest="manifest",
+            action="store_true",
+            help="Write the pks and hashes of the exported rows to <output>.manifest.json",
+        )
+        parser.add_argument(
+            "--since",
+            default=None,
+            dest="since",
+            type=str,
+            help="Path of a previous fixture written with --manifest, only the rows "
+            "that are new or changed since are written, as a delta for load_dev_db --delta",
+        )
+        parser.add_argument(
+            "--profile",
+            default=False,
+            dest="profile",
+            action="store_true",
+            help="Print the queries, rows, bytes and time of every model and relation",
+        )
+        parser.add_argument(
+            "--profile-out",
+            default=None,
+            dest="profile_out",
+            type=str,
+            help="Write the profile of --profile as JSON to this path",
+        )
         parser.add_argument(
             "--clear-cache",
             default=False,
@@ -68,53 +149,125 @@ class Command(BaseCommand):
         # setup the options
         self.indent = options.get("indent", 4)
         self.limit = options.get("limit")
+        self.batch_size = options.get("batch_size")
+        self.workers = options.get("workers")
+        self.stream = options.get("stream")
+        self.max_rows = options.get("max_rows")
+        self.max_bytes = options.get("max_bytes")
         self.output = Path(options.get("output"))
         self.clearcache = options.get("clearcache")
-        self.format = options.get("format") or (
-            self.output.suffixes[0][1:].lower() if self.output.suffixes else "json"
+        self.compression_level = options.get("compression_level")
+        self.compression_threads = options.get("compression_threads")
+        self.since = options.get("since") and Path(options.get("since"))
+        self.manifest = options.get("manifest") or self.since is not None
+        self.profile_out = options.get("profile_out") and Path(
+            options.get("profile_out")
         )
+        self.profile = options.get("profile") or self.profile_out is not None
+
+        if self.since is not None and not manifest_path(self.since).exists():
+            raise CommandError("No manifest found for %s" % self.since)
+
+        self.format = options.get("format") or fixture_format(self.output)
         self._validate_serializer(self.format)
         logger.info("serializing using %s and indent %s", self.format, self.indent)
 
-        t = Timer()
+        profiler = Profiler()
         creator = get_creator_instance()
         logger.info("using creator instance %s", creator)
 
+        if self.batch_size:
+            creator.batch_size = self.batch_size
+
+        if self.workers:
+            creator.workers = self.workers
+
+        if self.stream:
+            creator.stream = True
+
+        if self.max_rows is not None:
+            creator.max_rows = self.max_rows
+
+        if self.max_bytes is not None:
+            creator.max_bytes = self.max_bytes
+
+        if self.profile:
+            creator.profiler = profiler
+
         if self.clearcache:
             logger.info("clearing the model settings cache")
-            cache.delete("cached_model_settings")
-
-        model_settings = creator.get_cached_model_settings()
-
-        logger.info("model_settings lookup took %.2f s", next(t))
-        data = creator.collect_data(model_settings, limit=self.limit)
-        logger.info("data collection took %.2f s", next(t))
-        extra_data = creator.add_extra_data(data)
-        logger.info("adding extra data took %.2f s", next(t))
-        filtered_data = creator.filter_data(extra_data)
-        logger.info("filtering data took %.2f s", next(t))
-        logger.info("in total, we collected %d unique instances", len(extra_data))
+            creator.clear_cache()
+
+        with profiler.phase("model_settings lookup"):
+            model_settings = creator.get_cached_model_settings()
+
+        if self.since is not None:
+            # the extra data of the delta are added by collect_delta
+            with profiler.phase("delta collection"):
+                previous = Manifest.load(manifest_path(self.since))
+                extra_data, manifest = creator.collect_delta(
+                    model_settings, previous, limit=self.limit
+                )
+        else:
+            with profiler.phase("data collection"):
+                data = creator.collect_data(model_settings, limit=self.limit)
+
+            with profiler.phase("adding extra data"):
+                extra_data = creator.add_extra_data(data)
+
+        with profiler.phase("filtering data"):
+            filtered_data = creator.filter_data(extra_data)
+
+        logger.info("in total, we collected %d unique instances", len(filtered_data))
+
         logger.info(
             "serializing data with format %s (this can take a while)", self.format
         )
-        serialized = serializers.serialize(
-            self.format,
-            filtered_data,
-            indent=self.indent,
-            use_natural_foreign_keys=False,
-        )
+        objects = creator.order_data(filtered_data)
+        hasher = None
+
+        if self.manifest and self.since is None:
+            # hashed as they are serialized, the streamed instances are only
+            # loaded once
+            hasher = RowHasher(creator.batch_size)
+            objects = hasher.track(objects)
 
-        fopen = gzip.open if self.output.suffix == ".gz" else open
+        with profiler.phase("serializing data"):
+            write_fixture(
+                self.output.resolve(),
+                self.format,
+                objects,
+                compression_level=self.compression_level,
+                threads=self.compression_threads,
+                profiler=profiler if self.profile else None,
+                indent=self.indent,
+                use_natural_foreign_keys=False,
+            )
 
-        with fopen(self.output.resolve(), "wb") as f:
-            f.write(serialized.encode())
+        if self.manifest:
+            with profiler.phase("writing the manifest"):
+                if hasher is not None:
+                    manifest = Manifest(dict(hasher.hashes))
 
-        logger.info("serializing data took %.2f s", next(t))
-        logger.info("total duration %.2f s", t.total)
+                manifest.save(manifest_path(self.output.resolve()))
+
+        logger.info("total duration %.2f s", sum(x for _, x in profiler.phases))
+        self._report(profiler)
+
+    def _report(self, profiler):
+        if self.profile_out is not None:
+            profiler.save(self.profile_out)
+            logger.info("profile written to %s", self.profile_out)
+
+        if self.profile:
+            self.stdout.write(profiler.report(limit=PROFILE_REPORT_ROWS))
 
     def _validate_serializer(self, format):
         # Check that the serialization format exists; this is a shortcut to
         # avoid collating all the objects and _then_ failing.
+        if format == columnar.FORMAT:
+            return
+
         try:
             serializers.get_serializer(format)
         except KeyError:
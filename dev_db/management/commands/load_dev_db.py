@@ -1,6 +1,7 @@
 """
 Loads data from the main database
 """
+
 import logging
 from pathlib import Path
 
@@ -9,11 +10,19 @@ from django.db import connection
 from django.contrib.auth.models import Permission
 from django.contrib.contenttypes.models import ContentType
 from django.core.management import call_command
-from django.core.management.base import BaseCommand
+from django.core.management.base import BaseCommand, CommandError
 from django.db.models.signals import pre_save, post_save
 
+from dev_db import columnar
+from dev_db.fixtures import fixture_format, fixture_tables, read_fixture
+from dev_db.incremental import Manifest, manifest_path
+from dev_db.loaders import get_loader
+from dev_db.profiling import Profiler
+
 logger = logging.getLogger(__name__)
 DEBUG = False
+# number of relations in the summary table of --profile
+PROFILE_REPORT_ROWS = 30
 
 
 class Command(BaseCommand):
@@ -36,10 +45,82 @@ class Command(BaseCommand):
             action="store_true",
             help="Do not ask the users whether they are sure or not",
         )
+        parser.add_argument(
+            "--engine",
+            default="loaddata",
+            dest="engine",
+            choices=["bulk", "loaddata"],
+            help="Save the objects one by one with Django's loaddata, or insert "
+            "the rows table by table with COPY or raw inserts, without sending "
+            "signals or calling save (bulk) (default: loaddata)",
+        )
+        parser.add_argument(
+            "--ignorenonexistent",
+            default=False,
+            dest="ignorenonexistent",
+            action="store_true",
+            help="Ignore the fields and models of the fixture that are missing "
+            "from the project",
+        )
+        parser.add_argument(
+            "--batch-size",
+            default=None,
+            dest="batch_size",
+            type=int,
+            help="Number of rows per insert with the bulk engine",
+        )
+        parser.add_argument(
+            "--jobs",
+            default=1,
+            dest="jobs",
+            type=int,
+            help="Number of tables loaded concurrently with the bulk engine, "
+            "each on its own database connection (default: 1)",
+        )
+        parser.add_argument(
+            "--delta",
+            default=False,
+            dest="delta",
+            action="store_true",
+            help="Apply a delta fixture written by create_dev_db --since on top of "
+            "the loaded database, using its manifest",
+        )
+        parser.add_argument(
+            "--ordered",
+            default=False,
+            dest="ordered",
+            action="store_true",
+            help="The fixture is in dependency order, as create_dev_db writes it, "
+            "insert it table by table without disabling the constraint checks",
+        )
+        parser.add_argument(
+            "--profile",
+            default=False,
+            dest="profile",
+            action="store_true",
+            help="Print the rows and time of every model with the bulk engine",
+        )
+        parser.add_argument(
+            "--profile-out",
+            default=None,
+            dest="profile_out",
+            type=str,
+            help="Write the profile of --profile as JSON to this path",
+        )
 
     def handle(self, **options):
         self.input = Path(options.get("input"))
         self.yes = options.get("yes")
+        self.engine = options.get("engine")
+        self.ignorenonexistent = options.get("ignorenonexistent")
+        self.batch_size = options.get("batch_size")
+        self.jobs = options.get("jobs")
+        self.delta = options.get("delta")
+        self.ordered = options.get("ordered")
+        self.profile_out = options.get("profile_out") and Path(
+            options.get("profile_out")
+        )
+        self.profile = options.get("profile") or self.profile_out is not None
 
         fixture_path = (
             self.input
@@ -48,6 +129,30 @@ class Command(BaseCommand):
         )
         logger.info("loading the fixture from %s", fixture_path)
 
+        if self.engine == "loaddata":
+            if self.delta or self.ordered or self.jobs > 1 or self.batch_size:
+                raise CommandError(
+                    "--delta, --ordered, --jobs and --batch-size require --engine bulk"
+                )
+
+            if fixture_format(fixture_path) == columnar.FORMAT:
+                raise CommandError(
+                    "loaddata cannot read %s fixtures, use --engine bulk"
+                    % columnar.FORMAT
+                )
+
+            if fixture_path.suffix.lower() in (".zst", ".lz4"):
+                raise CommandError(
+                    "loaddata cannot read %s fixtures, use --engine bulk"
+                    % fixture_path.suffix
+                )
+
+        if self.delta and not manifest_path(fixture_path).exists():
+            raise CommandError("No manifest found for %s" % fixture_path)
+
+        if self.ordered and (self.delta or self.jobs > 1):
+            raise CommandError("--ordered cannot be combined with --delta or --jobs")
+
         if not self.yes:
             print(
                 "Beware, this step will delete data from your database {} at {}.".format(
@@ -70,17 +175,57 @@ class Command(BaseCommand):
             signal.receivers = []
 
         # ContentType and Permission models are populated by the migrations and
-        # that would clash with the loaded data, so we need to truncate these tables
-        logger.info("cleaning ContentType and Permission models")
-        ContentType.objects.all().delete()
-        Permission.objects.all().delete()
-
-        call_command(
-            "loaddata",
-            fixture_path,
-            traceback=True,
-            verbosity=3,
-        )
+        # that would clash with the loaded data, so we need to truncate these tables,
+        # unless a delta is applied on top of previously loaded ones
+        if not self.delta:
+            logger.info("cleaning ContentType and Permission models")
+            ContentType.objects.all().delete()
+            Permission.objects.all().delete()
+
+        profiler = Profiler()
+
+        with profiler.phase("loading data"):
+            if self.engine == "loaddata":
+                call_command(
+                    "loaddata",
+                    fixture_path,
+                    ignore=self.ignorenonexistent,
+                    traceback=True,
+                    verbosity=3,
+                )
+            else:
+                self._load(fixture_path, profiler)
 
         for signal, receivers in signals.items():
             signal.receivers = receivers
+
+        if self.profile_out is not None:
+            profiler.save(self.profile_out)
+            logger.info("profile written to %s", self.profile_out)
+
+        if self.profile:
+            self.stdout.write(profiler.report(limit=PROFILE_REPORT_ROWS))
+
+    def _load(self, fixture_path, profiler):
+        loader = get_loader(**self._loader_options())
+        objects = read_fixture(fixture_path, ignorenonexistent=self.ignorenonexistent)
+
+        if self.profile:
+            loader.profiler = profiler
+            objects = profiler.deserialized(objects)
+
+        if self.delta:
+            manifest = Manifest.load(manifest_path(fixture_path))
+            count = loader.load_delta(objects, manifest)
+        elif self.jobs > 1:
+            with fixture_tables(
+                fixture_path, ignorenonexistent=self.ignorenonexistent
+            ) as tables:
+                count = loader.load_tables(tables, jobs=self.jobs)
+        else:
+            count = loader.load(objects, ordered=self.ordered)
+
+        logger.info("loaded %d rows with %s", count, type(loader).__name__)
+
+    def _loader_options(self):
+        return {"batch_size": self.batch_size} if self.batch_size else {}
@@ -0,0 +1,225 @@
+"""
+Instrumentation of create_dev_db and load_dev_db
+
+The Profiler records the wall time of the phases of a command, and for every
+model and relation the number of queries, rows and bytes, and the time spent
+in the database and in Python. The queries are counted and timed with an
+execute wrapper on the connection of the thread running them, so the numbers
+are right with several workers too. The serialization, and deserialization,
+of every model is timed by wrapping the iterator of the objects, and the bytes
+written are counted on the output stream, or by the devdb writer per chunk.
+"""
+from collections import defaultdict
+from contextlib import contextmanager
+import json
+import logging
+from threading import Lock
+import time
+
+from django.db import connections
+
+from dev_db.utils import model_name
+
+logger = logging.getLogger(__name__)
+
+
+class Stats:
+    __slots__ = ("queries", "rows", "bytes", "db_time", "time")
+
+    def __init__(self):
+        self.queries = 0
+        self.rows = 0
+        self.bytes = 0
+        self.db_time = 0.0
+        self.time = 0.0
+
+    @property
+    def python_time(self):
+        return max(0.0, self.time - self.db_time)
+
+    def add(self, other):
+        for name in self.__slots__:
+            setattr(self, name, getattr(self, name) + getattr(other, name))
+
+    def to_json(self):
+        data = {name: getattr(self, name) for name in self.__slots__}
+        data["python_time"] = self.python_time
+        return data
+
+
+class Profiler:
+    """
+    Collects the Stats of the phases, and of every (model, relation)
+
+    The relations are free form labels: "sample", "forward", "reverse
+    app.Model.field", "insert"... The rows of a measure are set by the caller,
+    its bytes too when they are known, e.g. estimated from the table sizes.
+    """
+
+    def __init__(self):
+        self.phases = []
+        self.stats = defaultdict(Stats)
+        self.lock = Lock()
+        # the model being serialized
+        self.current = None
+
+    @contextmanager
+    def phase(self, name):
+        start = time.perf_counter()
+
+        try:
+            yield
+        finally:
+            duration = time.perf_counter() - start
+            self.phases.append((name, duration))
+            logger.info("%s took %.2f s", name, duration)
+
+    @contextmanager
+    def measure(self, model, relation, using=None):
+        """
+        Times the block and the queries it runs on the connection of using, by
+        default the one of the model
+        """
+        stats = Stats()
+        connection = connections[using or model._base_manager.db]
+
+        def wrapper(execute, sql, params, many, context):
+            start = time.perf_counter()
+
+            try:
+                return execute(sql, params, many, context)
+            finally:
+                stats.queries += 1
+                stats.db_time += time.perf_counter() - start
+
+        start = time.perf_counter()
+
+        try:
+            with connection.execute_wrapper(wrapper):
+                yield stats
+        finally:
+            stats.time = time.perf_counter() - start
+            self.record(model, relation, stats)
+
+    def record(self, model, relation, stats):
+        with self.lock:
+            self.stats[model_name(model), relation].add(stats)
+
+    def serialized(self, objects, relation="serialize"):
+        """
+        Wraps the objects being serialized, the time the serializer spends on
+        every object, until it asks for the next one, is recorded for its model
+
+        The clock is stopped while the next object is produced, so the queries
+        loading the objects, e.g. the chunks of a stream, are not counted.
+        """
+        for obj in objects:
+            model = type(obj)
+            stats = self.stats[model_name(model), relation]
+            stats.rows += 1
+            self.current = model
+            start = time.perf_counter()
+            yield obj
+            stats.time += time.perf_counter() - start
+
+    def deserialized(self, objects, relation="deserialize"):
+        """
+        Wraps the deserialized objects, the time spent reading every object is
+        recorded for its model
+        """
+        iterator = iter(objects)
+
+        while True:
+            start = time.perf_counter()
+
+            try:
+                obj = next(iterator)
+            except StopIteration:
+                return
+
+            stats = self.stats[model_name(type(obj.object)), relation]
+            stats.time += time.perf_counter() - start
+            stats.rows += 1
+            yield obj
+
+    def counting(self, stream, relation="serialize"):
+        """
+        Wraps the output stream of serialized, counting the bytes written for
+        the model being serialized
+        """
+        return CountingStream(stream, self, relation)
+
+    def written(self, label, size, relation="serialize"):
+        """
+        Records size bytes written for the label, a model name, by the writers
+        buffering the objects of several models, see dev_db.columnar
+        """
+        with self.lock:
+            self.stats[label, relation].bytes += size
+
+    def to_json(self):
+        return {
+            "phases": [{"name": x, "time": y} for x, y in self.phases],
+            "total_time": sum(y for _, y in self.phases),
+            "relations": [
+                dict(model=model, relation=relation, **stats.to_json())
+                for (model, relation), stats in self.sorted_stats()
+            ],
+        }
+
+    def save(self, path):
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(self.to_json(), f, indent=4)
+
+    def sorted_stats(self):
+        return sorted(self.stats.items(), key=lambda x: (-x[1].time, x[0]))
+
+    def report(self, limit=None):
+        """
+        A summary table of the phases and of the relations taking the most time
+        """
+        lines = ["%-40s %10s" % ("phase", "time (s)")]
+        lines.extend(
+            "%-40s %10.2f" % (name, duration) for name, duration in self.phases
+        )
+        lines.append("")
+        lines.append(
+            "%-30s %-40s %8s %8s %10s %9s %9s"
+            % ("model", "relation", "queries", "rows", "bytes", "db (s)", "py (s)")
+        )
+
+        for (model, relation), stats in self.sorted_stats()[:limit]:
+            lines.append(
+                "%-30s %-40s %8d %8d %10d %9.3f %9.3f"
+                % (
+                    model,
+                    relation,
+                    stats.queries,
+                    stats.rows,
+                    stats.bytes,
+                    stats.db_time,
+                    stats.python_time,
+                )
+            )
+
+        return "\n".join(lines)
+
+
+class CountingStream:
+    def __init__(self, stream, profiler, relation):
+        self.stream = stream
+        self.profiler = profiler
+        self.relation = relation
+
+    def write(self, data):
+        if self.profiler.current is not None:
+            stats = self.profiler.stats[
+                model_name(self.profiler.current), self.relation
+            ]
+            # the text streams of the Django formats are encoded in utf-8
+            stats.bytes += len(data.encode("utf-8") if isinstance(data, str) else data)
+
+        return self.stream.write(data)
+
+    def __getattr__(self, name):
+        return getattr(self.stream, name)
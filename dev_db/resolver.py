@@ -0,0 +1,517 @@
+"""
+Breadth-first resolution of the dependencies of the collected instances
+"""
+
+from collections import defaultdict
+from contextlib import nullcontext
+import logging
+from operator import itemgetter
+
+from django.contrib.auth.models import Permission
+from django.contrib.contenttypes.models import ContentType
+from django.db import connections
+from django.db.models.fields.related import ManyToManyField
+
+from dev_db.estimators import DEFAULT_ROW_BYTES
+from dev_db.pksets import PkSet
+from dev_db.profiling import Stats
+from dev_db.utils import WorkerPool, chunked, model_name
+
+logger = logging.getLogger(__name__)
+# the backends running WITH RECURSIVE queries
+RECURSIVE_CTE_VENDORS = {"mysql", "postgresql", "sqlite"}
+
+
+class Budget:
+    """
+    Caps the total number of rows, and estimated bytes, of the collected data
+
+    Only the optional dependencies are cut by the budget, the sampled rows and
+    their forward dependencies are always collected. The bytes are estimated
+    from the average row size of every table.
+    """
+
+    def __init__(self, max_rows=None, max_bytes=None, row_bytes=None):
+        self.max_rows = max_rows
+        self.max_bytes = max_bytes
+        self.row_bytes = row_bytes or {}
+        self.rows = 0
+        self.bytes = 0.0
+
+    def spend(self, model, rows):
+        self.rows += rows
+        self.bytes += rows * self.row_bytes.get(model, DEFAULT_ROW_BYTES)
+
+    def release(self, model, rows):
+        self.spend(model, -rows)
+
+    def remaining(self, model):
+        """
+        How many more rows of the model fit in the budget, None if unlimited
+        """
+        limits = []
+
+        if self.max_rows is not None:
+            limits.append(self.max_rows - self.rows)
+
+        if self.max_bytes is not None:
+            row_bytes = self.row_bytes.get(model, DEFAULT_ROW_BYTES)
+            limits.append(int((self.max_bytes - self.bytes) // row_bytes))
+
+        return max(0, min(limits)) if limits else None
+
+    @property
+    def exhausted(self):
+        return (self.max_rows is not None and self.rows >= self.max_rows) or (
+            self.max_bytes is not None and self.bytes >= self.max_bytes
+        )
+
+
+class DependencyResolver:
+    """
+    Collects the dependencies of the given instances level by level
+
+    Instead of walking every relation depth first, the resolver keeps a frontier
+    of the instances whose relations were not followed yet. Each round gathers
+    the pending pks of a dependency from all its parents and fetches them with
+    a single pk__in query, until no new instances turn up. The number of queries
+    thus scales with the depth of the dependency graph, not with its fan-out.
+
+    - forward dependencies (instances referenced by a foreign key or a many to
+      many field) are always followed
+    - reverse dependencies (instances referencing the given ones) are only
+      followed for instances added with reverse=True, up to the model limit
+
+    Self referencing foreign keys, the cycles of a single model in the
+    dependency graph, are followed with a WITH RECURSIVE query where the
+    backend supports it, so a whole chain of parents is selected at once
+    rather than one level per round. The other cycles need a round per level.
+
+    The frontier only holds (pk, foreign keys...) tuples. With pks_only, these
+    are all that is fetched while discovering the closure, and the full
+    instances are loaded with one query per model once the walk is done.
+
+    The pk sets are never sent to the database whole: filters are split in
+    chunks of the creator batch_size, and the already fetched pks are excluded
+    in Python rather than in the query. fetched_pks should map the models to
+    PkSets, which hold the integer pks compactly, plain sets work too.
+
+    With several workers, the queries of a round run concurrently on their own
+    database connections.
+
+    With stream, which implies pks_only, run does not load the instances: the
+    result maps every model to an InstanceStream over the collected pks, which
+    loads them chunk by chunk when iterated, e.g. by the serializer.
+
+    Once the budget is spent, no more reverse dependencies are followed.
+    """
+
+    def __init__(
+        self,
+        creator,
+        result,
+        fetched_pks,
+        pks_only=False,
+        workers=1,
+        budget=None,
+        profiler=None,
+        stream=False,
+    ):
+        self.creator = creator
+        self.result = result
+        self.fetched_pks = fetched_pks
+        self.pks_only = pks_only or stream
+        self.stream = stream
+        self.pool = WorkerPool(workers)
+        self.budget = budget or Budget()
+        self.profiler = profiler
+        self.forward = defaultdict(list)
+        self.reverse = defaultdict(list)
+        self.deferred = defaultdict(PkSet)
+        self._fields = {}
+
+    def add(self, model, instances, reverse=False):
+        """
+        Schedules the relations of already fetched instances to be followed
+        """
+        rows = self._rows(model, instances)
+        self.budget.spend(model, len(rows))
+        self._schedule(model, rows, reverse)
+
+    def fetch(self, model, queryset, reverse=False, limit=None, relation="fetch"):
+        """
+        Collects the instances of the queryset and schedules their relations
+
+        When a limit is given, no more instances of the model are collected
+        once that many have been fetched. The relation labels the queries for
+        the profiler.
+        """
+        self.fetch_many([(model, queryset, reverse, limit, relation)])
+
+    def fetch_many(self, requests):
+        """
+        Runs fetch for every (model, queryset, reverse, limit, relation) request
+
+        The querysets are evaluated concurrently by the worker threads, but
+        collected in the order of the requests, so the result does not depend
+        on the number of workers
+        """
+        models, querysets, _, limits, relations = (
+            zip(*requests) if requests else ((),) * 5
+        )
+        results = self.pool.map(self._evaluate, models, querysets, limits, relations)
+
+        for (model, _, reverse, limit, _), rows in zip(requests, results):
+            self._schedule(model, self._collect(model, rows, limit, reverse), reverse)
+
+    def run(self):
+        """
+        Follows the relations until the dependency graph reaches a fixpoint
+
+        Forward dependencies are required for referential integrity, so they
+        are always resolved before the next round of reverse dependencies
+        """
+        try:
+            while self.forward or self.reverse:
+                if self.forward:
+                    self._forward_round()
+                else:
+                    self._reverse_round()
+
+            self._load()
+        finally:
+            self.pool.close()
+
+    def _forward_round(self):
+        frontier, self.forward = self.forward, defaultdict(list)
+        pending = defaultdict(set)
+        m2m = []
+        chains = defaultdict(set)
+
+        for model, rows in self._items(frontier):
+            pks = tuple(map(itemgetter(0), rows))
+            column = 1
+
+            for dependency, field in self._forward_fields(model):
+                logger.info(
+                    "fetching dependency %s -> %s",
+                    model_name(model),
+                    model_name(dependency),
+                )
+
+                if isinstance(field, ManyToManyField):
+                    m2m.extend((dependency, field, x) for x in self._chunked(pks))
+                elif self._follows_chain(model, dependency):
+                    chains[model, field].update(map(itemgetter(column), rows))
+                    column += 1
+                else:
+                    pending[dependency].update(map(itemgetter(column), rows))
+                    column += 1
+
+        dependencies, fields, chunks = zip(*m2m) if m2m else ((),) * 3
+
+        for dependency, pks in zip(
+            dependencies, self.pool.map(self._m2m_pks, fields, chunks)
+        ):
+            pending[dependency].update(pks)
+
+        models, fields, chunks = [], [], []
+
+        for (model, field), pks in sorted(
+            chains.items(), key=lambda x: (model_name(x[0][0]), x[0][1].name)
+        ):
+            pks.discard(None)
+            pks = pks - self.fetched_pks[model]
+
+            for chunk in self._chunked(sorted(pks)):
+                models.append(model)
+                fields.append(field)
+                chunks.append(chunk)
+
+        for model, pks in zip(
+            models, self.pool.map(self._chain_pks, models, fields, chunks)
+        ):
+            pending[model].update(pks)
+
+        requests = []
+
+        for dependency, pks in self._items(pending):
+            pks.discard(None)
+            pks = pks - self.fetched_pks[dependency]
+            requests.extend(
+                (
+                    dependency,
+                    dependency._base_manager.filter(pk__in=x),
+                    False,
+                    None,
+                    "forward",
+                )
+                for x in self._chunked(sorted(pks))
+            )
+
+        self.fetch_many(requests)
+
+    def _reverse_round(self):
+        frontier, self.reverse = self.reverse, defaultdict(list)
+        requests = []
+
+        if self.budget.exhausted:
+            logger.info("budget reached, not following the reverse dependencies")
+            return
+
+        for model, rows in self._items(frontier):
+            pks = tuple(map(itemgetter(0), rows))
+
+            for dependency, attr in self.creator.dependency_graph.reverse_edges(model):
+                logger.info(
+                    "fetching dependency %s <- %s",
+                    model_name(model),
+                    model_name(dependency),
+                )
+                limit = self.creator.get_limit(dependency)
+                remaining = self.budget.remaining(dependency)
+
+                if remaining is not None:
+                    limit = min(limit, len(self.fetched_pks[dependency]) + remaining)
+
+                # the already fetched rows are skipped in Python, so at most
+                # limit rows are needed to find the remaining new ones
+                requests.extend(
+                    (
+                        dependency,
+                        dependency._base_manager.filter(**{attr + "__in": x})[:limit],
+                        True,
+                        limit,
+                        "reverse %s" % attr,
+                    )
+                    for x in self._chunked(pks)
+                )
+
+        self.fetch_many(requests)
+
+    def _m2m_pks(self, field, pks):
+        """
+        Selects the targets of the many to many relation for the given pks
+        with a single query against the through table
+        """
+        through = field.remote_field.through
+        target = through._meta.get_field(field.m2m_reverse_field_name()).attname
+        relation = "m2m %s.%s" % (model_name(field.model), field.name)
+
+        with self._measure(field.related_model, relation) as stats:
+            pks = list(
+                through._base_manager.filter(
+                    **{field.m2m_field_name() + "__in": pks}
+                ).values_list(target, flat=True)
+            )
+            stats.rows = len(pks)
+
+        return pks
+
+    def _follows_chain(self, model, dependency):
+        """
+        Whether the self reference is followed with a recursive query, which
+        selects the whole chain of parents at once instead of a level per round
+        """
+        connection = connections[model._base_manager.db]
+        return dependency is model and connection.vendor in RECURSIVE_CTE_VENDORS
+
+    def _chain_pks(self, model, field, pks):
+        """
+        Selects the given pks and the pks of all their ancestors through the
+        self referencing foreign key, with a single recursive query
+
+        The chain ends with a NULL parent, which is discarded with the others
+        """
+        connection = connections[model._base_manager.db]
+        quote_name = connection.ops.quote_name
+        table = quote_name(model._meta.db_table)
+        pk = quote_name(model._meta.pk.column)
+        parent = quote_name(field.column)
+        sql = """
+            WITH RECURSIVE chain (pk) AS (
+                SELECT {pk} FROM {table} WHERE {pk} IN ({params})
+                UNION
+                SELECT t.{parent} FROM {table} t
+                INNER JOIN chain ON t.{pk} = chain.pk
+            )
+            SELECT pk FROM chain
+        """.format(
+            table=table, pk=pk, parent=parent, params=", ".join(["%s"] * len(pks))
+        )
+        params = [model._meta.pk.get_db_prep_value(x, connection) for x in pks]
+
+        with self._measure(model, "chain %s" % field.name) as stats:
+            with connection.cursor() as cursor:
+                cursor.execute(sql, params)
+                rows = cursor.fetchall()
+
+            stats.rows = len(rows)
+
+        return [model._meta.pk.to_python(x) for x, in rows if x is not None]
+
+    def _evaluate(self, model, queryset, limit=None, relation="fetch"):
+        """
+        Runs the query, this is the only part done by the worker threads
+        """
+        if limit is not None and len(self.fetched_pks.get(model, ())) >= limit:
+            return []
+
+        if self.pks_only:
+            queryset = queryset.values_list(*self._columns(model))
+
+        with self._measure(model, relation) as stats:
+            rows = list(queryset.iterator(chunk_size=self.creator.batch_size))
+            stats.rows = len(rows)
+
+            if not self.pks_only:
+                row_bytes = self.budget.row_bytes.get(model, DEFAULT_ROW_BYTES)
+                stats.bytes = int(len(rows) * row_bytes)
+
+        return rows
+
+    def _measure(self, model, relation):
+        if self.profiler is None:
+            return nullcontext(Stats())
+
+        return self.profiler.measure(model, relation)
+
+    def _collect(self, model, rows, limit=None, optional=False):
+        """
+        Records the rows, skipping the instances fetched before
+
+        The optional rows are only collected as long as the budget allows
+        """
+        fetched_pks = self.fetched_pks[model]
+        new = []
+
+        for row in rows:
+            if limit is not None and len(fetched_pks) >= limit:
+                break
+
+            if optional and self.budget.remaining(model) == 0:
+                break
+
+            pk = row[0] if self.pks_only else row.pk
+
+            if pk not in fetched_pks:
+                fetched_pks.add(pk)
+                new.append(row)
+                self.budget.spend(model, 1)
+
+        if self.pks_only:
+            self.deferred[model].update(map(itemgetter(0), new))
+            return new
+
+        self.result[model].extend(new)
+        return self._rows(model, new)
+
+    def _load(self):
+        deferred, self.deferred = self.deferred, defaultdict(PkSet)
+        models, querysets = [], []
+
+        for model, pks in self._items(deferred):
+            if self.stream:
+                self.result[model] = InstanceStream(
+                    model, pks, self.creator.batch_size, self._load_chunk
+                )
+                continue
+
+            logger.info("loading %d instances of %s", len(pks), model_name(model))
+
+            for chunk in self._chunked(pks):
+                models.append(model)
+                querysets.append(model._base_manager.filter(pk__in=chunk))
+
+        for model, instances in zip(
+            models, self.pool.map(self._load_chunk, models, querysets)
+        ):
+            self.result[model].extend(instances)
+
+    def _load_chunk(self, model, queryset):
+        with self._measure(model, "load") as stats:
+            instances = list(queryset.iterator(chunk_size=self.creator.batch_size))
+            stats.rows = len(instances)
+            row_bytes = self.budget.row_bytes.get(model, DEFAULT_ROW_BYTES)
+            stats.bytes = int(len(instances) * row_bytes)
+
+        return instances
+
+    def _schedule(self, model, rows, reverse):
+        if not rows:
+            return
+
+        self.forward[model].extend(rows)
+
+        if reverse:
+            self.reverse[model].extend(rows)
+
+    def _rows(self, model, instances):
+        columns = self._columns(model)
+        return [tuple(getattr(x, column) for column in columns) for x in instances]
+
+    def _columns(self, model):
+        """
+        The pk followed by the foreign keys of the forward dependencies
+        """
+        columns = ["pk"]
+
+        for dependency, field in self._forward_fields(model):
+            if not isinstance(field, ManyToManyField):
+                columns.append(field.attname)
+
+        return columns
+
+    def _forward_fields(self, model):
+        if model not in self._fields:
+            self._fields[model] = [
+                (dependency, model._meta.get_field(attr))
+                for dependency, attr in self.creator.dependency_graph.forward_edges(
+                    model
+                )
+                if not (
+                    self.creator.exclude_content_type
+                    and issubclass(dependency, (ContentType, Permission))
+                )
+            ]
+
+        return self._fields[model]
+
+    def _chunked(self, pks):
+        return chunked(pks, self.creator.batch_size)
+
+    def _items(self, mapping):
+        return sorted(mapping.items(), key=lambda x: model_name(x[0]))
+
+
+class InstanceStream:
+    """
+    The instances of the model with the given pks, a PkSet, loaded batch_size
+    at a time by load(model, queryset) when iterated
+
+    Only the pks are kept, every iteration queries the instances again. They
+    are iterated in the order of the pks, or of order, a list of the pks.
+    """
+
+    def __init__(self, model, pks, batch_size, load):
+        self.model = model
+        self.pks = pks
+        self.batch_size = batch_size
+        self.load = load
+        self.order = None
+
+    def __len__(self):
+        return len(self.pks)
+
+    def __iter__(self):
+        pks = self.pks if self.order is None else self.order
+
+        for chunk in chunked(pks, self.batch_size):
+            queryset = self.model._base_manager.filter(pk__in=chunk).order_by("pk")
+            instances = self.load(self.model, queryset)
+
+            if self.order is not None:
+                position = {pk: i for i, pk in enumerate(chunk)}
+                instances.sort(key=lambda x: position[x.pk])
+
+            yield from instances
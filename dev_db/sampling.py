@@ -0,0 +1,257 @@
+"""
+Sampling strategies, selecting which rows of a model end up in the sample
+
+A sampler returns a queryset of at most limit instances of the model, or a list
+of querysets when the sampled pks are filtered batch_size at a time. None of
+them needs ORDER BY random(), so they stay cheap on very large tables.
+"""
+
+import logging
+import random
+
+from django.db import connections
+from django.db.models import Max, Min, QuerySet
+from django.db.models.expressions import RawSQL
+
+from dev_db.utils import chunked, model_name
+
+logger = logging.getLogger(__name__)
+
+
+class Sampler:
+    def sample(self, model, limit, table_size=None, batch_size=None):
+        """
+        Returns a queryset of at most limit instances of the model, or a list of
+        querysets adding up to at most limit instances
+
+        table_size is the estimated TableSize of the model, if known, and
+        batch_size the maximum number of pks sent in a single filter
+        """
+        raise NotImplementedError
+
+    def get_connection(self, model):
+        return connections[model._default_manager.db]
+
+    def filter_pks(self, manager, pks, batch_size=None):
+        """
+        The querysets of the rows with the pks, batch_size pks per query so the
+        filters stay below the bind parameter limit of the database
+        """
+        pks = sorted(pks)
+        return [
+            manager.filter(pk__in=chunk).order_by("pk")
+            for chunk in chunked(pks, batch_size or len(pks) or 1)
+        ]
+
+
+def sample_querysets(sample):
+    """
+    The list of querysets of the sample returned by Sampler.sample
+    """
+    return [sample] if isinstance(sample, QuerySet) else list(sample)
+
+
+class LatestSampler(Sampler):
+    """
+    Takes the newest rows, this is the default
+    """
+
+    def sample(self, model, limit, table_size=None, batch_size=None):
+        return model._default_manager.order_by("-pk")[:limit]
+
+
+class RandomPkSampler(Sampler):
+    """
+    Picks random pks between the smallest and the largest pk of the table
+
+    Only two index lookups are needed for the pk range. Some of the picked pks
+    may not exist, so more of them are picked based on the estimated density
+    of the range. They are checked max_candidates at a time, which keeps the
+    queries below the bind parameter limit, until limit rows are found. A range
+    sparser than estimated takes more rounds, the density being re-estimated
+    from the rows found. After max_rounds rounds, the sample is topped up with
+    the rows following a random pk, so it only comes out smaller than the
+    limit when the table has fewer rows.
+    Tables without an integer pk fall back to the latest rows.
+    """
+
+    def __init__(self, seed=None, oversample=2, max_candidates=900, max_rounds=10):
+        self.random = random.Random(seed)
+        self.oversample = oversample
+        self.max_candidates = max_candidates
+        self.max_rounds = max_rounds
+
+    def sample(self, model, limit, table_size=None, batch_size=None):
+        manager = model._default_manager
+        pk_range = manager.aggregate(low=Min("pk"), high=Max("pk"))
+        low, high = pk_range["low"], pk_range["high"]
+
+        if not isinstance(low, int) or not isinstance(high, int):
+            return LatestSampler().sample(model, limit, table_size)
+
+        span = high - low + 1
+        density = min(1.0, table_size.rows / span) if table_size else 1.0
+        tried, found = set(), []
+
+        for _ in range(self.max_rounds):
+            if len(found) >= limit or len(tried) >= span:
+                break
+
+            candidates = self._candidates(low, high, tried, limit - len(found), density)
+
+            # the candidates are in random order, so stopping early keeps the
+            # sample uniform
+            for chunk in chunked(candidates, self.max_candidates):
+                found.extend(
+                    manager.filter(pk__in=sorted(chunk)).values_list("pk", flat=True)
+                )
+
+                if len(found) >= limit:
+                    break
+
+            tried.update(candidates)
+            density = len(found) / len(tried)
+
+        if len(found) < limit:
+            logger.debug(
+                "%s: %d of %d random pks found", model_name(model), len(found), limit
+            )
+            self._top_up(manager, low, high, found, limit)
+
+        return self.filter_pks(manager, found[:limit], batch_size)
+
+    def _top_up(self, manager, low, high, found, limit):
+        """
+        Adds the rows following a random pk to found, wrapping around to the
+        start of the range, until there are limit of them
+        """
+        pivot = self.random.randint(low, high)
+        seen = set(found)
+
+        for queryset in (manager.filter(pk__gte=pivot), manager.filter(pk__lt=pivot)):
+            needed = limit - len(found)
+
+            if needed <= 0:
+                break
+
+            pks = queryset.order_by("pk").values_list("pk", flat=True)
+            found.extend(
+                [x for x in pks[: needed + len(seen)] if x not in seen][:needed]
+            )
+
+    def _candidates(self, low, high, tried, needed, density):
+        """
+        Random pks of the range not tried yet, enough to find needed rows at
+        the density
+        """
+        remaining = high - low + 1 - len(tried)
+        count = int(needed * self.oversample / max(density, 0.01))
+
+        if count >= remaining:
+            candidates = [x for x in range(low, high + 1) if x not in tried]
+            self.random.shuffle(candidates)
+            return candidates
+
+        return [
+            x
+            for x in self.random.sample(range(low, high + 1), max(count, 1))
+            if x not in tried
+        ]
+
+
+class TableSampleSampler(Sampler):
+    """
+    Uses TABLESAMPLE SYSTEM (random pages) or BERNOULLI (random rows)
+
+    The sampling percentage is derived from the estimated table size. It is only
+    supported by PostgreSQL, other databases fall back to RandomPkSampler.
+    """
+
+    def __init__(self, method="SYSTEM", seed=None, oversample=2):
+        if method not in ("SYSTEM", "BERNOULLI"):
+            raise ValueError("Unknown TABLESAMPLE method %s" % method)
+
+        self.method = method
+        self.seed = seed
+        self.oversample = oversample
+
+    def sample(self, model, limit, table_size=None, batch_size=None):
+        connection = self.get_connection(model)
+
+        if connection.vendor != "postgresql":
+            return RandomPkSampler(self.seed, self.oversample).sample(
+                model, limit, table_size, batch_size
+            )
+
+        rows = table_size.rows if table_size else 0
+        percent = min(100.0, 100.0 * limit * self.oversample / rows) if rows else 100.0
+        sql = "SELECT %s FROM %s TABLESAMPLE %s (%%s)" % (
+            connection.ops.quote_name(model._meta.pk.column),
+            connection.ops.quote_name(model._meta.db_table),
+            self.method,
+        )
+        params = [percent]
+
+        if self.seed is not None:
+            sql += " REPEATABLE (%s)"
+            params.append(self.seed)
+
+        sql += " LIMIT %s"
+        params.append(limit)
+
+        return model._default_manager.filter(pk__in=RawSQL(sql, params))
+
+
+class StratifiedSampler(Sampler):
+    """
+    Splits the limit evenly between the distinct values of a field
+
+    Every stratum is sampled with its own index-friendly query, so the field
+    should be indexed. On very large tables, pass the values of the strata,
+    as listing the distinct values requires a scan otherwise. Every stratum
+    gets at least one row, so only the first limit values, in the order of
+    the field, are sampled when there are more, with a warning.
+    """
+
+    def __init__(self, field, values=None):
+        self.field = field
+        self.values = values
+
+    def sample(self, model, limit, table_size=None, batch_size=None):
+        manager = model._default_manager
+        values = self.values
+
+        if values is None:
+            values = manager.order_by(self.field).values_list(self.field, flat=True)
+            values = list(values.distinct()[: limit + 1])
+
+        if len(values) > limit:
+            logger.warning(
+                "%s has more than %d values of %s, only the first %d are sampled",
+                model_name(model),
+                limit,
+                self.field,
+                limit,
+            )
+            values = values[:limit]
+
+        if not values:
+            return manager.none()
+
+        logger.info(
+            "sampling %s in %d strata of %s",
+            model_name(model),
+            len(values),
+            self.field,
+        )
+        per_stratum = max(1, limit // len(values))
+        pks = []
+
+        for value in values:
+            pks.extend(
+                manager.filter(**{self.field: value})
+                .order_by("-pk")
+                .values_list("pk", flat=True)[:per_stratum]
+            )
+
+        return self.filter_pks(manager, pks, batch_size)
@@ -1,16 +1,10 @@
 """
 Model level functions
 """
-import time
-
-
-def get_max_id(model):
-    last = model._default_manager.order_by("-pk").first()
-    return last.pk if last and isinstance(last, int) else 0
-
-
-def get_field_names(model):
-    return [f.name for f in model._meta.fields]
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+from pathlib import Path
+from threading import Barrier
 
 
 def model_name(model):
@@ -28,17 +22,31 @@ def get_all_fields(model):
 
 
 """
-Instance level functions
+General utilities
 """
 
 
-def hash_instance(instance):
-    return hash((instance.__class__, instance.pk))
+def chunked(iterable, size):
+    """
+    Splits the iterable into tuples of at most size items
+    """
+    iterator = iter(iterable)
+    chunk = tuple(islice(iterator, size))
 
+    while chunk:
+        yield chunk
+        chunk = tuple(islice(iterator, size))
 
-"""
-General utilities
-"""
+
+def get_cache_dir():
+    """
+    The directory of the files dev_db caches between runs, the DEV_DB_CACHE_DIR
+    setting or ~/.cache/dev_db
+    """
+    from django.conf import settings
+
+    cache_dir = getattr(settings, "DEV_DB_CACHE_DIR", None)
+    return Path(cache_dir) if cache_dir else Path.home() / ".cache" / "dev_db"
 
 
 def get_creator_instance():
@@ -95,36 +103,43 @@ def get_class_from_string(path, default="raise"):
     return backend_class
 
 
-class Timer:
-    def __init__(self):
-        self.times = [time.time()]
-        self.total = 0.0
-        next(self)
+class WorkerPool:
+    """
+    Maps functions over a pool of threads, each using its own database connection
 
-    def __iter__(self):
-        while True:
-            yield next(self)
+    With a single worker, the functions are simply called in the current thread.
+    Like the builtin map, the results are returned lazily and in order.
+    """
 
-    def __next__(self):
-        times = self.times
-        times.append(time.time())
-        delta = times[-1] - times[-2]
-        self.total += delta
-        return delta
+    def __init__(self, workers=1):
+        self.workers = workers
+        self.executor = None
 
-    def get_avg(self, default=None):
-        if self.times:
-            return self.total / len(self.times)
-        return default
+    def map(self, fn, *iterables):
+        if self.workers <= 1:
+            return map(fn, *iterables)
 
-    avg = property(get_avg)
+        if self.executor is None:
+            self.executor = ThreadPoolExecutor(self.workers)
 
+        return self.executor.map(fn, *iterables)
 
-def get_profile_class():
-    from django.conf import settings
-    from django.db import models
+    def close(self):
+        """
+        Closes the database connections of the threads and shuts the pool down
+        """
+        if self.executor is None:
+            return
+
+        # every thread waits for the others, so each one gets exactly one task
+        barrier = Barrier(self.workers)
+
+        def close_connections(_):
+            from django.db import connections
 
-    profile_string = settings.AUTH_PROFILE_MODULE
-    app_label, model = profile_string.split(".")
+            barrier.wait()
+            connections.close_all()
 
-    return models.get_model(app_label, model)
+        list(self.executor.map(close_connections, range(self.workers)))
+        self.executor.shutdown()
+        self.executor = None
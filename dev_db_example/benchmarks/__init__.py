@@ -0,0 +1,6 @@
+"""
+Benchmarks of the dev_db commands, they are not part of the test suite
+
+From the dev_db_example directory run:
+    python manage.py test benchmarks --pattern "bench_*.py"
+"""
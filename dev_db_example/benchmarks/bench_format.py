@@ -0,0 +1,70 @@
+import tempfile
+import time
+from itertools import chain
+from pathlib import Path
+
+from django.test.testcases import TestCase
+
+from dev_db.fixtures import read_fixture, write_fixture
+from example.models import Extra, NotRelatedToUser, NotRelatedToUserDependency
+
+ROWS = 20000
+
+
+class FormatBenchmark(TestCase):
+    models = [NotRelatedToUserDependency, NotRelatedToUser, Extra]
+
+    @classmethod
+    def setUpTestData(cls):
+        NotRelatedToUserDependency.objects.bulk_create(
+            NotRelatedToUserDependency(pk=pk, text="dependency %d" % pk)
+            for pk in range(1, ROWS + 1)
+        )
+        NotRelatedToUser.objects.bulk_create(
+            NotRelatedToUser(pk=pk, dependency_id=pk, text="text %d" % pk)
+            for pk in range(1, ROWS + 1)
+        )
+        Extra.objects.bulk_create(
+            Extra(pk=pk, extra_chars="x %d" % pk) for pk in range(1, ROWS + 1)
+        )
+
+    def _measure(self, path, format):
+        objects = list(
+            chain.from_iterable(model.objects.order_by("pk") for model in self.models)
+        )
+        start = time.perf_counter()
+        write_fixture(path, format, objects)
+        written = time.perf_counter()
+        count = sum(1 for _ in read_fixture(path))
+        read = time.perf_counter()
+
+        self.assertEqual(count, len(objects))
+        return written - start, read - written, path.stat().st_size
+
+    def test_format(self):
+        """
+        Serialize time, read time and file size of devdb against json.gz
+        """
+        with tempfile.TemporaryDirectory() as directory:
+            json_write, json_read, json_size = self._measure(
+                Path(directory) / "data.json.gz", "json"
+            )
+            write, read, size = self._measure(Path(directory) / "data.devdb", "devdb")
+
+        print(
+            "\njson.gz: write %.2f s, read %.2f s, %d KB"
+            % (json_write, json_read, json_size // 1024)
+        )
+        print(
+            "devdb: write %.2f s (%.1fx), read %.2f s (%.1fx), %d KB (%.1fx)"
+            % (
+                write,
+                json_write / write,
+                read,
+                json_read / read,
+                size // 1024,
+                json_size / size,
+            )
+        )
+        self.assertLess(write, json_write)
+        self.assertLess(read, json_read)
@@ -0,0 +1,78 @@
+import tempfile
+import time
+from itertools import chain
+from pathlib import Path
+
+from django.core.management import call_command
+from django.test.testcases import TransactionTestCase
+
+from dev_db.fixtures import read_fixture, write_fixture
+from dev_db.loaders import get_loader
+from example.models import (
+    Extra,
+    M2MRegular,
+    NotRelatedToUser,
+    NotRelatedToUserDependency,
+)
+
+ROWS = 5000
+
+
+class LoadBenchmark(TransactionTestCase):
+    # the flushes between the transaction tests recreate the content types with
+    # new pks, the ones of the test database are restored instead
+    serialized_rollback = True
+    models = [NotRelatedToUserDependency, NotRelatedToUser, M2MRegular, Extra]
+
+    def _write(self, path):
+        dependencies = [
+            NotRelatedToUserDependency(pk=pk, text="dependency %d" % pk)
+            for pk in range(1, ROWS + 1)
+        ]
+        not_related = [
+            NotRelatedToUser(pk=pk, dependency_id=pk, text="text %d" % pk)
+            for pk in range(1, ROWS + 1)
+        ]
+        NotRelatedToUserDependency.objects.bulk_create(dependencies)
+        NotRelatedToUser.objects.bulk_create(not_related)
+
+        for pk in range(1, ROWS // 10 + 1):
+            M2MRegular.objects.create(pk=pk, text="m2m %d" % pk).m2m.set(
+                range(pk, pk + 10)
+            )
+
+        Extra.objects.bulk_create(
+            Extra(pk=pk, extra_chars="x" * 200) for pk in range(1, ROWS + 1)
+        )
+        objects = chain.from_iterable(
+            model.objects.order_by("pk") for model in self.models
+        )
+        write_fixture(path, "json", objects)
+        self._clear()
+
+    def _clear(self):
+        for model in reversed(self.models):
+            model.objects.all().delete()
+
+    def _time(self, load):
+        start = time.perf_counter()
+        load()
+        duration = time.perf_counter() - start
+        self._clear()
+        return duration
+
+    def test_load(self):
+        """
+        Rows per second of loaddata and of the bulk loader
+        """
+        with tempfile.TemporaryDirectory() as directory:
+            path = Path(directory) / "data.json.gz"
+            self._write(path)
+            rows = sum(1 for _ in read_fixture(path)) + ROWS
+
+            loaddata = self._time(lambda: call_command("loaddata", path, verbosity=0))
+            bulk = self._time(lambda: get_loader().load(read_fixture(path)))
+
+        print("\nloaddata: %d rows/s" % (rows / loaddata))
+        print("bulk: %d rows/s (%.1fx)" % (rows / bulk, loaddata / bulk))
+        self.assertLess(bulk, loaddata)
@@ -0,0 +1,69 @@
+import random
+import time
+import tracemalloc
+
+from django.test.testcases import SimpleTestCase
+
+from dev_db.pksets import PkSet
+
+PKS = 1000000
+CANDIDATES = 500
+ROUNDS = 200
+
+
+class PkSetBenchmark(SimpleTestCase):
+    def setUp(self):
+        random.seed(0)
+        self.pks = random.sample(range(PKS * 4), PKS)
+        self.rounds = [
+            set(random.sample(range(PKS * 4), CANDIDATES)) for _ in range(ROUNDS)
+        ]
+
+    def _measure(self, factory):
+        start = time.perf_counter()
+        fetched = factory()
+        fetched.update(self.pks)
+        added = time.perf_counter()
+        missing = 0
+
+        for candidates in self.rounds:
+            # what the resolver does in every round
+            missing += len(candidates - fetched)
+
+        subtracted = time.perf_counter()
+
+        # traced separately, tracemalloc slows the allocations down
+        tracemalloc.start()
+        fetched = factory()
+        fetched.update(self.pks)
+        size, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        return added - start, subtracted - added, size, peak, missing
+
+    def test_pk_set(self):
+        """
+        Memory, insertion time and resolver style difference of PkSet against set
+        """
+        results = {}
+
+        for factory in (set, PkSet):
+            results[factory] = self._measure(factory)
+            add, sub, size, peak, _ = results[factory]
+            print(
+                "\n%s: add %.2f s, %d rounds %.3f s, %.1f MB (peak %.1f MB)"
+                % (factory.__name__, add, ROUNDS, sub, size / 2**20, peak / 2**20)
+            )
+
+        self.assertEqual(results[set][-1], results[PkSet][-1])
+
+        start = time.perf_counter()
+        fetched = set(self.pks)
+
+        for candidates in self.rounds:
+            set(candidates).difference_update(fetched)
+
+        print(
+            "set.difference_update, as done before: %d rounds %.3f s"
+            % (ROUNDS, time.perf_counter() - start)
+        )
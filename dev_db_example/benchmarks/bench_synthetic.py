@@ -0,0 +1,237 @@
+import json
+import os
+import subprocess
+import tempfile
+import time
+import tracemalloc
+import unittest
+from pathlib import Path
+from unittest import mock
+
+from django.core.management import call_command
+from django.db import connection
+from django.test.testcases import TransactionTestCase
+from django.test.utils import override_settings
+
+from benchmarks.synthetic import SyntheticDevDBCreator, SyntheticSchema
+from dev_db.fixtures import read_fixture
+from dev_db.loaders import get_loader
+
+# rows per model, e.g. DEV_DB_BENCH_ROWS=100000 for millions of rows in total
+ROWS = int(os.environ.get("DEV_DB_BENCH_ROWS", 2000))
+# share of the rows create_dev_db samples, before following the relations
+SAMPLE = float(os.environ.get("DEV_DB_BENCH_SAMPLE", 0.01))
+# the fixture suffix, which sets its format
+SUFFIX = os.environ.get("DEV_DB_BENCH_SUFFIX", ".json.gz")
+# a JSON lines file the results are appended to, and compared against
+RESULTS = os.environ.get("DEV_DB_BENCH_RESULTS")
+# comma separated names of the schemas to run, all by default
+SCHEMAS = os.environ.get("DEV_DB_BENCH_SCHEMAS")
+
+
+def run(fn):
+    """
+    The number of queries and the wall time of the function
+    """
+    queries = 0
+
+    def wrapper(execute, sql, params, many, context):
+        nonlocal queries
+        queries += 1
+        return execute(sql, params, many, context)
+
+    start = time.perf_counter()
+
+    with connection.execute_wrapper(wrapper):
+        fn()
+
+    return queries, time.perf_counter() - start
+
+
+def peak_memory(fn):
+    """
+    The peak of the memory allocated by Python while the function runs, traced
+    separately as tracemalloc slows the allocations down
+    """
+    tracemalloc.start()
+
+    try:
+        fn()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            check=True,
+            text=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+class SyntheticBenchmark:
+    """
+    Runs create_dev_db and the loader of load_dev_db on the synthetic schema,
+    see benchmarks.synthetic
+
+    The loader is called directly, as load_dev_db also deletes the content
+    types and permissions the other benchmarks of the test database rely on.
+
+    Set DEV_DB_BENCH_RESULTS to a file to keep the results, every run is then
+    compared to the last run of the same schema on another commit.
+    """
+
+    schema = None
+    # keeps the content types of the test database across flushes, see
+    # benchmarks.bench_load
+    serialized_rollback = True
+
+    @classmethod
+    def setUpClass(cls):
+        if SCHEMAS and cls.schema.name not in SCHEMAS.split(","):
+            raise unittest.SkipTest("schema %s not selected" % cls.schema.name)
+
+        super().setUpClass()
+        cls.schema.build()
+        cls.schema.create_tables()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.schema.drop_tables()
+        cls.schema.unregister()
+        super().tearDownClass()
+
+    def test_commands(self):
+        """
+        Queries, wall time, peak memory and fixture size of both commands
+        """
+        schema = self.schema
+        start = time.perf_counter()
+        schema.populate()
+        print(
+            "\n%s %s: %d rows inserted in %.2f s"
+            % (
+                schema.name,
+                connection.vendor,
+                schema.total_rows,
+                time.perf_counter() - start,
+            )
+        )
+        target_rows = max(1, int(schema.model_count * schema.rows * SAMPLE))
+
+        with tempfile.TemporaryDirectory() as directory, override_settings(
+            DEV_DB_CREATOR="benchmarks.synthetic.SyntheticDevDBCreator"
+        ), mock.patch.object(SyntheticDevDBCreator, "target_rows", target_rows):
+            path = Path(directory) / ("data" + SUFFIX)
+
+            def create_dev_db():
+                call_command("create_dev_db", output=str(path), clearcache=True)
+
+            def load_dev_db():
+                get_loader().load(read_fixture(path))
+
+            queries, duration = run(create_dev_db)
+            create = {
+                "queries": queries,
+                "time": duration,
+                "peak_memory": peak_memory(create_dev_db),
+                "fixture_bytes": path.stat().st_size,
+                "rows": sum(1 for _ in read_fixture(path)),
+            }
+
+            schema.clear()
+            queries, duration = run(load_dev_db)
+            loaded = schema.count()
+            schema.clear()
+            load = {
+                "queries": queries,
+                "time": duration,
+                "peak_memory": peak_memory(load_dev_db),
+                "rows": loaded,
+            }
+
+        self.assertGreaterEqual(create["rows"], min(target_rows, schema.rows))
+        self.assertGreaterEqual(load["rows"], create["rows"])
+        self._report({"create_dev_db": create, "load_dev_db": load})
+
+    def _report(self, commands):
+        result = {
+            "commit": git_commit(),
+            "vendor": connection.vendor,
+            "schema": self.schema.name,
+            "params": dict(self.schema.params, sample=SAMPLE, suffix=SUFFIX),
+            "commands": commands,
+        }
+        previous = self._previous(result) if RESULTS else None
+
+        for command, stats in commands.items():
+            line = "%s: %d queries, %.2f s, peak %.1f MB, %d rows" % (
+                command,
+                stats["queries"],
+                stats["time"],
+                stats["peak_memory"] / 2**20,
+                stats["rows"],
+            )
+
+            if "fixture_bytes" in stats:
+                line += ", fixture %d KB" % (stats["fixture_bytes"] // 1024)
+
+            if previous is not None:
+                before = previous["commands"][command]
+                line += " (vs %s: %s)" % (
+                    previous["commit"],
+                    ", ".join(
+                        "%s %.2fx" % (x, stats[x] / before[x])
+                        for x in ("queries", "time", "peak_memory")
+                        if before[x]
+                    ),
+                )
+
+            print(line)
+
+        if RESULTS:
+            with open(RESULTS, "a", encoding="utf-8") as f:
+                f.write(json.dumps(result) + "\n")
+
+    def _previous(self, result):
+        """
+        The last result of the same schema and database from another commit
+        """
+        try:
+            with open(RESULTS, encoding="utf-8") as f:
+                results = [json.loads(x) for x in f if x.strip()]
+        except FileNotFoundError:
+            return None
+
+        for previous in reversed(results):
+            if previous["commit"] != result["commit"] and all(
+                previous[x] == result[x] for x in ("vendor", "schema", "params")
+            ):
+                return previous
+
+        return None
+
+
+class WideSchemaBenchmark(SyntheticBenchmark, TransactionTestCase):
+    schema = SyntheticSchema("wide", model_count=20, fan_out=3, depth=2, rows=ROWS)
+
+
+class DeepSchemaBenchmark(SyntheticBenchmark, TransactionTestCase):
+    schema = SyntheticSchema("deep", model_count=20, fan_out=1, depth=10, rows=ROWS)
+
+
+class ManyToManySchemaBenchmark(SyntheticBenchmark, TransactionTestCase):
+    schema = SyntheticSchema(
+        "m2m", model_count=10, fan_out=2, depth=3, m2m_density=1.0, rows=ROWS
+    )
+
+
+class SelfLoopSchemaBenchmark(SyntheticBenchmark, TransactionTestCase):
+    schema = SyntheticSchema(
+        "self_loops", model_count=10, fan_out=1, depth=3, self_loops=1.0, rows=ROWS
+    )
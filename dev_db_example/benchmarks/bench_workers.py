@@ -0,0 +1,51 @@
+import time
+from unittest import mock
+
+from django.db.backends.utils import CursorWrapper
+from django.test.testcases import TransactionTestCase
+
+from example.dev_db_creator import ExampleDevDBCreator
+
+# simulated network round-trip to a remote database
+LATENCY = 0.02
+
+
+def with_latency(execute):
+    def wrapped_execute(self, *args, **kwargs):
+        time.sleep(LATENCY)
+        return execute(self, *args, **kwargs)
+
+    return wrapped_execute
+
+
+class WorkersBenchmark(TransactionTestCase):
+    # the flushes between the transaction tests recreate the content types with
+    # new pks, the ones of the test database are restored instead
+    serialized_rollback = True
+    fixtures = ["auth.json", "example.json"]
+
+    def _collect(self, workers):
+        creator = ExampleDevDBCreator()
+        creator.workers = workers
+        model_settings = creator.get_model_settings()
+        start = time.perf_counter()
+
+        with mock.patch.object(
+            CursorWrapper, "_execute", with_latency(CursorWrapper._execute)
+        ):
+            creator.collect_data(model_settings)
+
+        return time.perf_counter() - start
+
+    def test_workers(self):
+        """
+        Collection with N workers against a database with a 20 ms latency
+        """
+        single = self._collect(1)
+        print("\n1 worker: %.2f s" % single)
+
+        for workers in (2, 4, 8):
+            duration = self._collect(workers)
+            print("%d workers: %.2f s (%.1fx)" % (workers, duration, single / duration))
+
+        self.assertLess(self._collect(4), single)
@@ -0,0 +1,225 @@
+"""
+Synthetic schemas for the benchmarks of create_dev_db and load_dev_db
+
+A SyntheticSchema builds Django models at runtime, registered in the example
+app, creates their tables and populates them. The models are spread over depth
+levels, every model references fan_out models of the lower levels, a share of
+them references itself (self_loops) and a share has a many to many relation
+(m2m_density), so the shape of the dependency graph can be varied without
+writing models by hand.
+"""
+from collections import defaultdict
+import random
+
+from django.apps import apps
+from django.db import connection, models, transaction
+
+from dev_db.creator import DevDBCreator
+from dev_db.pksets import PkSet
+
+APP_LABEL = "example"
+TABLE_PREFIX = "synthetic_"
+# the targets of every row of a many to many relation
+M2M_LINKS = 3
+INSERT_BATCH_SIZE = 1000
+
+
+class SyntheticSchema:
+    def __init__(
+        self,
+        name,
+        model_count=10,
+        fan_out=1,
+        depth=3,
+        m2m_density=0.0,
+        self_loops=0.0,
+        rows=1000,
+        seed=0,
+    ):
+        self.name = name
+        self.model_count = model_count
+        self.fan_out = fan_out
+        self.depth = depth
+        self.m2m_density = m2m_density
+        self.self_loops = self_loops
+        self.rows = rows
+        self.seed = seed
+        self.models = []
+
+    @property
+    def params(self):
+        return {
+            "model_count": self.model_count,
+            "fan_out": self.fan_out,
+            "depth": self.depth,
+            "m2m_density": self.m2m_density,
+            "self_loops": self.self_loops,
+            "rows": self.rows,
+        }
+
+    @property
+    def total_rows(self):
+        """
+        The rows of the models and of their many to many tables
+        """
+        m2m = sum(len(x._meta.local_many_to_many) for x in self.models)
+        return len(self.models) * self.rows + m2m * self.rows * M2M_LINKS
+
+    def build(self):
+        """
+        Creates and registers the models, the model i is on the level i % depth
+        """
+        rng = random.Random(self.seed)
+        levels = defaultdict(list)
+
+        for i in range(self.model_count):
+            level = i % self.depth
+            lower = [model for x in range(level) for model in levels[x]]
+            name = "%s%d" % (self.name.title().replace("_", ""), i)
+            fields = {
+                "text": models.CharField(max_length=100),
+                "number": models.IntegerField(),
+            }
+
+            for j, target in enumerate(
+                rng.sample(lower, min(self.fan_out, len(lower)))
+            ):
+                fields["fk_%d" % j] = models.ForeignKey(
+                    target,
+                    on_delete=models.CASCADE,
+                    related_name="%s_fk_%d" % (name.lower(), j),
+                )
+
+            if rng.random() < self.self_loops:
+                fields["parent"] = models.ForeignKey(
+                    "self",
+                    null=True,
+                    on_delete=models.CASCADE,
+                    related_name="children",
+                )
+
+            if lower and rng.random() < self.m2m_density:
+                fields["links"] = models.ManyToManyField(
+                    rng.choice(lower), related_name="%s_links" % name.lower()
+                )
+
+            model = self._model(name, fields)
+            levels[level].append(model)
+            self.models.append(model)
+
+        return self.models
+
+    def _model(self, name, fields):
+        meta = type(
+            "Meta",
+            (),
+            {"app_label": APP_LABEL, "db_table": TABLE_PREFIX + name.lower()},
+        )
+        return type(name, (models.Model,), dict(fields, __module__=__name__, Meta=meta))
+
+    def create_tables(self):
+        with connection.schema_editor() as editor:
+            for model in self.models:
+                editor.create_model(model)
+
+    def drop_tables(self):
+        with connection.schema_editor() as editor:
+            for model in reversed(self.models):
+                editor.delete_model(model)
+
+    def unregister(self):
+        """
+        Removes the models, and their many to many models, from the app registry
+        """
+        registered = apps.all_models[APP_LABEL]
+
+        for name, model in list(registered.items()):
+            if model._meta.db_table.startswith(TABLE_PREFIX):
+                del registered[name]
+
+        apps.clear_cache()
+        self.models = []
+
+    def populate(self):
+        """
+        Inserts rows rows in every model, the models are created in level order
+        so the foreign keys point to existing rows
+        """
+        rng = random.Random(self.seed)
+
+        with transaction.atomic():
+            for model in self.models:
+                model._base_manager.bulk_create(
+                    (self._instance(model, pk, rng) for pk in range(1, self.rows + 1)),
+                    batch_size=INSERT_BATCH_SIZE,
+                )
+
+                for field in model._meta.local_many_to_many:
+                    through = field.remote_field.through
+                    through._base_manager.bulk_create(
+                        (
+                            through(
+                                **{
+                                    field.m2m_field_name() + "_id": pk,
+                                    field.m2m_reverse_field_name() + "_id": target,
+                                }
+                            )
+                            for pk in range(1, self.rows + 1)
+                            for target in rng.sample(range(1, self.rows + 1), M2M_LINKS)
+                        ),
+                        batch_size=INSERT_BATCH_SIZE,
+                    )
+
+    def _instance(self, model, pk, rng):
+        values = {"pk": pk, "text": "row %d" % pk, "number": rng.randrange(10**6)}
+
+        for field in model._meta.local_fields:
+            if not field.is_relation:
+                continue
+
+            if field.name == "parent":
+                # parents have smaller pks, so the rows do not form cycles
+                values[field.attname] = rng.randrange(1, pk) if pk > 1 else None
+            else:
+                values[field.attname] = rng.randrange(1, self.rows + 1)
+
+        return model(**values)
+
+    def clear(self):
+        """
+        Deletes all the rows, the foreign keys are only checked at the commit
+        """
+        tables = [x._meta.db_table for x in self.models]
+        tables.extend(
+            x.remote_field.through._meta.db_table
+            for model in self.models
+            for x in model._meta.local_many_to_many
+        )
+
+        with transaction.atomic(), connection.cursor() as cursor:
+            for table in tables:
+                cursor.execute("DELETE FROM %s" % connection.ops.quote_name(table))
+
+    def count(self):
+        return sum(
+            model._base_manager.count()
+            + sum(
+                x.remote_field.through._base_manager.count()
+                for x in model._meta.local_many_to_many
+            )
+            for model in self.models
+        )
+
+
+class SyntheticDevDBCreator(DevDBCreator):
+    """
+    Only collects the models of the synthetic schemas, without custom data
+    """
+
+    def get_all_models(self):
+        return [
+            x for x in apps.get_models() if x._meta.db_table.startswith(TABLE_PREFIX)
+        ]
+
+    def get_custom_data(self):
+        return defaultdict(list), defaultdict(PkSet)
@@ -0,0 +1,16 @@
+import tempfile
+
+from django.test.runner import DiscoverRunner
+from django.test.utils import override_settings
+
+
+class DevDBTestRunner(DiscoverRunner):
+    """
+    Runs the tests with a cache directory of their own, the model settings
+    cached for the test database do not outlive the run
+    """
+
+    def run_tests(self, *args, **kwargs):
+        with tempfile.TemporaryDirectory(prefix="dev_db_") as directory:
+            with override_settings(DEV_DB_CACHE_DIR=directory):
+                return super().run_tests(*args, **kwargs)
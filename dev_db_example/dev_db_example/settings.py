@@ -1,4 +1,5 @@
 # Django settings for dev_db_example project.
+import os
 
 DEBUG = True
 TEMPLATE_DEBUG = DEBUG
@@ -21,6 +22,13 @@ DATABASES = {
     }
 }
 
+# run the tests and benchmarks on PostgreSQL with DEV_DB_POSTGRES=<database>,
+# the connection parameters are read from the PG* environment variables
+if os.environ.get("DEV_DB_POSTGRES"):
+    DATABASES["default"].update(
+        ENGINE="django.db.backends.postgresql", NAME=os.environ["DEV_DB_POSTGRES"]
+    )
+
 # Hosts/domain names that are valid for this site; required if DEBUG is False
 # See https://docs.djangoproject.com/en/1.5/ref/settings/#allowed-hosts
 ALLOWED_HOSTS = []
@@ -134,6 +142,12 @@ INSTALLED_APPS = (
 )
 
 DEV_DB_CREATOR = "example.dev_db_creator.ExampleDevDBCreator"
+# the cached model settings and dependency graphs of the example project, the
+# tests use a directory of their own, see dev_db_example.runner
+DEV_DB_CACHE_DIR = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))), ".dev_db_cache"
+)
+TEST_RUNNER = "dev_db_example.runner.DevDBTestRunner"
 
 # A sample logging configuration. The only tangible logging
 # performed by this configuration is to send an email to
@@ -1,12 +1,61 @@
+import gzip
+import importlib
+import json
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from array import array
+from collections import defaultdict
+from contextlib import contextmanager
+from itertools import chain
 from operator import attrgetter
+from pathlib import Path
+from unittest import mock, skipUnless
 
 from django.core import serializers
-from django.test.testcases import TestCase
+from django.core.exceptions import FieldDoesNotExist
+from django.core.serializers.base import DeserializationError
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.test.testcases import SimpleTestCase, TestCase, TransactionTestCase
 from django.contrib.sessions.models import Session
 from django.contrib.auth.models import User, Permission, Group
 from django.contrib.sites.models import Site as DjangoSite
 from django.contrib.contenttypes.models import ContentType
 
+from dev_db import columnar
+from dev_db.cache import DiskCache
+from dev_db.creator import CollectedData
+from dev_db.dependencies import (
+    DependencyGraph,
+    dependency_levels,
+    get_dependency_graph,
+    get_dependency_mapping,
+    parent_first,
+)
+from dev_db.estimators import TableSize
+from dev_db.fixtures import (
+    ParallelGzipWriter,
+    fixture_tables,
+    open_fixture,
+    read_fixture,
+    write_fixture,
+)
+from dev_db.incremental import Manifest, manifest_path
+from dev_db.loaders import BulkLoader, PostgreSQLCopyLoader
+from dev_db.pksets import PkSet
+from dev_db.profiling import Profiler
+from dev_db.sampling import (
+    LatestSampler,
+    RandomPkSampler,
+    StratifiedSampler,
+    TableSampleSampler,
+    sample_querysets,
+)
+from dev_db.utils import model_name
+
 from .dev_db_creator import ExampleDevDBCreator
 from .models import (
     UserDependency,
@@ -22,6 +71,21 @@ from .models import (
 )
 
 
+def collect(**attributes):
+    """
+    Collects the data of an ExampleDevDBCreator with the given attributes,
+    returns the creator, its model settings and the filtered data
+    """
+    creator = ExampleDevDBCreator()
+
+    for name, value in attributes.items():
+        setattr(creator, name, value)
+
+    model_settings = creator.get_model_settings()
+    data = creator.filter_data(creator.collect_data(model_settings))
+    return creator, model_settings, data
+
+
 class CreatorTestCase(TestCase):
     fixtures = ["auth.json", "example.json"]
 
@@ -47,6 +111,19 @@ class CreatorTestCase(TestCase):
         models = self.creator.get_models()
         self.assertTrue(models)
 
+    def test_model_listing_queries(self):
+        """
+        The tables are validated in bulk, not with a query per model
+        """
+        with CaptureQueriesContext(connection) as queries:
+            self.creator.get_models()
+
+        self.assertLessEqual(len(queries), 1)
+
+        creator = ExampleDevDBCreator()
+        creator.probe_tables = True
+        self.assertCountEqual(creator.get_models(), self.creator.get_models())
+
     def test_model_settings(self):
         """
         A correct settings are loaded
@@ -64,13 +141,78 @@ class CreatorTestCase(TestCase):
             (Through, 30),
             (Session, 30),
             (DjangoSite, 30),
-            (Permission, 30),
+            (Permission, 10),
             (Group, 30),
             (User, 30),
             (ContentType, 30),
         ]
         self.assertCountEqual(model_settings, expected_result)
 
+    def test_cached_model_settings(self):
+        """
+        The model settings and table sizes are reused by the next creators,
+        until the cache is cleared or the key changes
+        """
+        with tempfile.TemporaryDirectory() as directory:
+            with self.settings(DEV_DB_CACHE_DIR=directory):
+                creator = ExampleDevDBCreator()
+                model_settings = creator.get_cached_model_settings()
+
+                with mock.patch.object(
+                    ExampleDevDBCreator, "get_model_settings"
+                ) as get_model_settings:
+                    creator = ExampleDevDBCreator()
+                    self.assertEqual(
+                        creator.get_cached_model_settings(), model_settings
+                    )
+                    self.assertEqual(creator.table_sizes, self.creator.table_sizes)
+                    self.assertFalse(get_model_settings.called)
+
+                    creator.target_rows = 100
+                    creator.get_cached_model_settings()
+                    self.assertEqual(get_model_settings.call_count, 1)
+
+                    creator = ExampleDevDBCreator()
+                    creator.clear_cache()
+                    creator.get_cached_model_settings()
+                    self.assertEqual(get_model_settings.call_count, 2)
+
+    def test_cache_timeout(self):
+        """
+        The cached values expire after their timeout
+        """
+        with tempfile.TemporaryDirectory() as directory:
+            cache = DiskCache(Path(directory))
+            cache.set("key", [1, 2])
+            cache.set("expired", [1, 2], timeout=-1)
+
+            self.assertEqual(cache.get("key"), [1, 2])
+            self.assertIsNone(cache.get("expired"))
+            self.assertIsNone(cache.get("missing"))
+
+    def test_table_sizes(self):
+        """
+        The table sizes are estimated with a constant number of queries
+        """
+        with CaptureQueriesContext(connection) as queries:
+            table_sizes = self.creator.get_table_sizes()
+
+        self.assertLessEqual(len(queries), 2)
+        self.assertEqual(table_sizes[User].rows, User.objects.count())
+        self.assertEqual(table_sizes[Loop].rows, Loop.objects.count())
+
+    def test_target_rows(self):
+        """
+        The target is split between the tables, small tables are sampled in full
+        """
+        creator = ExampleDevDBCreator()
+        creator.target_rows = 100
+        model_settings = dict(creator.get_model_settings())
+        # every table gets at least one row, even the empty ones
+        self.assertLessEqual(sum(model_settings.values()), 100 + len(model_settings))
+        self.assertEqual(model_settings[User], User.objects.count())
+        self.assertLess(model_settings[Permission], Permission.objects.count())
+
     def test_collect(self):
         """
         Some data are collected
@@ -87,6 +229,26 @@ class CreatorTestCase(TestCase):
         result = self.creator.filter_data(list_with_duplicates)
         self.assertEqual(result, correct_result)
 
+    def test_collected_data(self):
+        """
+        The duplicates are dropped as they are added, by model and pk
+        """
+        instance = UserDependency.objects.all()[:1][0]
+        data = self.creator.collect_data(self.creator.get_model_settings())
+        count = len(data)
+
+        data.append(instance)
+        data.extend([instance.user, DjangoSite.objects.get()])
+        data += [instance]
+        self.assertEqual(len(data), count)
+        self.assertIs(self.creator.filter_data(data), data)
+
+        data = CollectedData([Extra(pk=1), Loop(pk=1), Extra(pk=1)])
+        self.assertEqual([(type(x), x.pk) for x in data], [(Extra, 1), (Loop, 1)])
+        # the list methods are kept
+        self.assertEqual(data.index(data[1]), 1)
+        self.assertEqual(data.count(data[0]), 1)
+
     def test_full_create(self):
         """
         We are able to output a valid JSON
@@ -191,3 +353,1252 @@ class CreatorTestCase(TestCase):
 
         extra = self.creator.add_extra_data(extra)
         self.assertEqual(len(extra), 1)
+
+
+class OrderTestCase(TestCase):
+    fixtures = ["auth.json", "example.json"]
+
+    def setUp(self):
+        # a parent with a larger pk than its child
+        Loop.objects.create(pk=10, loop_text="root")
+        Loop.objects.filter(pk=1).update(parent=10)
+
+    def _ordered(self, **attributes):
+        creator, _, data = collect(**attributes)
+        return list(creator.order_data(creator.add_extra_data(data)))
+
+    def _assert_ordered(self, instances):
+        keys = {(x._meta.concrete_model, x.pk) for x in instances}
+        seen = set()
+        tables = []
+
+        for instance in instances:
+            model = instance._meta.concrete_model
+
+            for field in model._meta.concrete_fields:
+                if field.is_relation:
+                    key = (field.related_model, getattr(instance, field.attname))
+
+                    if key in keys:
+                        self.assertIn(key, seen, "%r before %r" % (instance, key))
+
+            for field in model._meta.many_to_many:
+                if not field.remote_field.through._meta.auto_created:
+                    continue
+
+                for pk in getattr(instance, field.name).values_list("pk", flat=True):
+                    self.assertIn((field.related_model, pk), seen)
+
+            seen.add((model, instance.pk))
+
+            if not tables or tables[-1] != model:
+                tables.append(model)
+
+        # grouped by table
+        self.assertEqual(len(tables), len(set(tables)))
+
+    def test_order(self):
+        """
+        The rows come after the rows they reference, table by table
+        """
+        instances = self._ordered()
+        self._assert_ordered(instances)
+        loops = [x.pk for x in instances if isinstance(x, Loop)]
+        self.assertEqual(loops, [10, 1, 2, 3, 4])
+
+    def test_stream_order(self):
+        """
+        The streamed rows are ordered too
+        """
+        instances = self._ordered(stream=True)
+        self._assert_ordered(instances)
+        self.assertEqual(
+            {(type(x), x.pk) for x in instances},
+            {(type(x), x.pk) for x in self._ordered()},
+        )
+
+    def test_cached_graph(self):
+        """
+        The tables are ordered with the dependency graph of the creator
+        """
+        creator, _, data = collect()
+        self.assertTrue(creator.dependency_graph)
+
+        with mock.patch.object(DependencyGraph, "compile") as compile:
+            self._assert_ordered(list(creator.order_data(data)))
+
+        self.assertFalse(compile.called)
+
+    def test_parent_first(self):
+        """
+        The parents come first, the rows of a cycle last
+        """
+        rows = [(1, 3), (2, None), (3, 2), (4, 5), (5, 4), (6, 6), (7, 1)]
+        self.assertEqual(parent_first(rows), [2, 6, 3, 1, 7, 4, 5])
+
+
+class M2MDependencyTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        dependency = NotRelatedToUserDependency.objects.create(text="dependency")
+        cls.targets = [
+            NotRelatedToUser.objects.create(dependency=dependency, text=str(i))
+            for i in range(10)
+        ]
+
+        for i in range(40):
+            instance = M2MRegular.objects.create(text=str(i))
+            instance.m2m.set(cls.targets[i % 7 : i % 7 + 3])
+
+    def _fetch(self, qs):
+        result = defaultdict(list)
+        creator = ExampleDevDBCreator()
+        creator.forward_mapping  # build the mapping outside of the measured block
+
+        with CaptureQueriesContext(connection) as queries:
+            creator._fetch_forward_dependencies(
+                M2MRegular, qs, result, defaultdict(set)
+            )
+
+        return result, len(queries)
+
+    def test_same_objects(self):
+        """
+        The batched lookup returns every target of the relation exactly once
+        """
+        qs = M2MRegular.objects.all()
+        result, _ = self._fetch(qs)
+        expected = {target for instance in qs for target in instance.m2m.all()}
+        self.assertCountEqual(result[NotRelatedToUser], expected)
+
+    def test_query_count(self):
+        """
+        The number of queries does not depend on the number of instances
+        """
+        _, few = self._fetch(M2MRegular.objects.order_by("pk")[:2])
+        _, many = self._fetch(M2MRegular.objects.order_by("pk")[:40])
+        self.assertEqual(few, many)
+
+
+class ResolverTestCase(TestCase):
+    fixtures = ["auth.json", "example.json"]
+
+    def _resolve(self, *roots):
+        result = defaultdict(list)
+        creator = ExampleDevDBCreator()
+        creator.dependency_graph
+
+        with CaptureQueriesContext(connection) as queries:
+            resolver = creator.get_resolver(result, defaultdict(set))
+
+            for model, instances in roots:
+                resolver.add(model, instances)
+
+            resolver.run()
+
+        return result, queries
+
+    def test_deep_chain(self):
+        """
+        Long self-referencing chains do not hit the recursion limit
+        """
+        parent = None
+
+        for i in range(sys.getrecursionlimit() + 100):
+            parent = Loop.objects.create(parent=parent, loop_text=str(i))
+
+        result, _ = self._resolve((Loop, [parent]))
+        self.assertEqual(len(result[Loop]), sys.getrecursionlimit() + 99)
+
+    def test_recursive_chain(self):
+        """
+        A chain of parents is selected with a recursive query, not level by level
+        """
+        parent = None
+
+        for i in range(100):
+            parent = Loop.objects.create(parent=parent, loop_text=str(i))
+
+        result, queries = self._resolve((Loop, [parent]))
+        self.assertEqual(len(result[Loop]), 99)
+        self.assertLessEqual(len(queries), 3)
+        self.assertIn("WITH RECURSIVE", queries[0]["sql"])
+
+    def test_shared_dependency(self):
+        """
+        A dependency reached from several parents is fetched with a single query
+        """
+        result, queries = self._resolve(
+            (Through, Through.objects.all()), (M2MRegular, M2MRegular.objects.all())
+        )
+        self.assertCountEqual(
+            result[NotRelatedToUser],
+            NotRelatedToUser.objects.filter(
+                pk__in=set(Through.objects.values_list("not_related", flat=True))
+                | set(
+                    M2MRegular.m2m.through.objects.values_list(
+                        "notrelatedtouser", flat=True
+                    )
+                )
+            ),
+        )
+
+        table = '"%s"' % NotRelatedToUser._meta.db_table
+        selects = [x for x in queries if x["sql"].split(" WHERE ")[0].endswith(table)]
+        self.assertEqual(len(selects), 1)
+
+
+class PkSetTestCase(SimpleTestCase):
+    def test_integers(self):
+        """
+        The integer pks are iterated in order, the dense ones stored in bitmaps
+        """
+        pks = PkSet([5, 3, 5, -1, 2**40])
+        pks.update(range(100000, 0, -3))
+        expected = {5, 3, -1, 2**40} | set(range(100000, 0, -3))
+
+        self.assertIsNone(pks.set)
+        self.assertEqual(len(pks), len(expected))
+        self.assertEqual(list(pks), sorted(expected))
+        self.assertTrue(isinstance(pks.containers[0], bytearray))
+        self.assertTrue(isinstance(pks.containers[2**40 >> 16], array))
+        self.assertIn(99997, pks)
+        self.assertIn(2**40, pks)
+        self.assertNotIn(99998, pks)
+        self.assertNotIn(-2, pks)
+        self.assertNotIn("5", pks)
+
+    def test_difference(self):
+        """
+        Subtracting a PkSet from a set keeps the missing pks
+        """
+        pks = PkSet(range(0, 5000, 2))
+        self.assertEqual({1, 2, 3, 4999, 5000} - pks, {1, 3, 4999, 5000})
+
+    def test_update(self):
+        """
+        The pks updated in bulk are the ones added one by one
+        """
+        batches = [range(0, 3000, 7), [5, 10, 12], range(1000, 70000, 2), [-3, 1]]
+        pks, added = PkSet(), PkSet()
+
+        for batch in batches:
+            pks.update(batch)
+
+            for pk in batch:
+                added.add(pk)
+
+        self.assertEqual(len(pks), len(added))
+        self.assertEqual(list(pks), list(added))
+        self.assertEqual(
+            set(range(-5, 80000)) - pks, set(range(-5, 80000)) - set(added)
+        )
+
+        pks.update([3, "a", 4])
+        self.assertEqual(pks.set, set(added) | {3, "a", 4})
+
+    def test_fallback(self):
+        """
+        Other pks turn the PkSet into a plain set
+        """
+        pks = PkSet([2, 1])
+        pks.add("a")
+        pks.add(2**64)
+
+        self.assertEqual(pks.set, {1, 2, "a", 2**64})
+        self.assertEqual(len(pks), 4)
+        self.assertIn(1, pks)
+        self.assertEqual({1, "a", "b"} - pks, {"b"})
+
+
+class DependencyGraphTestCase(SimpleTestCase):
+    models = [
+        UserDependency,
+        ForwardDependency,
+        ReverseDependency,
+        Loop,
+        M2MRegular,
+        M2MThrough,
+    ]
+
+    def test_graph(self):
+        """
+        The graph holds the same relations as the dependency mapping
+        """
+        graph = DependencyGraph.compile(self.models)
+        mapping = get_dependency_mapping(self.models)
+
+        self.assertEqual(graph.mapping(), {x: y for x, y in mapping.items() if y})
+        self.assertIn(User, graph.models)
+        self.assertIn(Through, graph.models)
+        self.assertEqual(graph.cycles, [[Loop]])
+        self.assertEqual(
+            graph.forward_edges(Through),
+            ((M2MThrough, "m2m"), (NotRelatedToUser, "not_related")),
+        )
+
+    def test_order(self):
+        """
+        Every model comes after the models it references
+        """
+        graph = DependencyGraph.compile(self.models)
+        position = {i: n for n, i in enumerate(graph.order)}
+
+        for i, edges in enumerate(graph.forward):
+            for j, _ in edges:
+                if graph.component_of[i] != graph.component_of[j]:
+                    self.assertLess(position[j], position[i])
+
+    def test_cache(self):
+        """
+        The graph is saved and loaded again while the relations do not change
+        """
+        with tempfile.TemporaryDirectory() as directory:
+            with self.settings(DEV_DB_CACHE_DIR=directory):
+                compiled = get_dependency_graph(self.models)
+
+                with mock.patch.object(DependencyGraph, "compile") as compile:
+                    cached = get_dependency_graph(self.models)
+
+                self.assertFalse(compile.called)
+                self.assertEqual(len(list(Path(directory).iterdir())), 1)
+
+        self.assertEqual(cached.models, compiled.models)
+        self.assertEqual(cached.forward, compiled.forward)
+        self.assertEqual(cached.reverse, compiled.reverse)
+        self.assertEqual(cached.components, compiled.components)
+
+
+class PksOnlyTestCase(TestCase):
+    fixtures = ["auth.json", "example.json"]
+
+    def _collect(self, **attributes):
+        with CaptureQueriesContext(connection) as queries:
+            _, _, data = collect(**attributes)
+
+        return {(type(x), x.pk) for x in data}, queries
+
+    def test_same_result(self):
+        """
+        Resolving only the pks collects the same instances
+        """
+        instances, _ = self._collect()
+        pks_only_instances, _ = self._collect(resolve_pks_only=True)
+        self.assertEqual(instances, pks_only_instances)
+
+    def test_single_load(self):
+        """
+        Full rows are only selected once per model
+        """
+        _, queries = self._collect(resolve_pks_only=True)
+        loads = [x for x in queries if '"more_text"' in x["sql"]]
+        self.assertEqual(len(loads), 1)
+
+    def test_stream(self):
+        """
+        The streamed instances are the same, and only loaded when iterated
+        """
+        instances, _ = self._collect()
+        streamed_instances, _ = self._collect(stream=True)
+        self.assertEqual(instances, streamed_instances)
+
+        creator = ExampleDevDBCreator()
+        creator.stream = True
+        model_settings = creator.get_model_settings()
+
+        with CaptureQueriesContext(connection) as queries:
+            data = creator.filter_data(creator.collect_data(model_settings))
+
+        column = '"example_notrelatedtouser"."text"'
+        self.assertFalse([x for x in queries if column in x["sql"]])
+
+        with CaptureQueriesContext(connection) as queries:
+            unrelated = [x for x in data if isinstance(x, NotRelatedToUser)]
+
+        self.assertEqual(len(unrelated), NotRelatedToUser.objects.count())
+        self.assertEqual(len([x for x in queries if column in x["sql"]]), 1)
+
+        # the streamed rows are indexed too
+        count = len(data)
+        data.append(unrelated[0])
+        self.assertEqual(len(data), count)
+        self.assertEqual(len(list(data)), count)
+        self.assertIn(unrelated[0], data)
+
+        # the copies and concatenations keep the streams
+        extra = Extra.objects.create(extra_chars="extra")
+        self.assertEqual(len(list(data.copy())), count)
+
+        for extended in (data + [extra, unrelated[0]], [extra, unrelated[0]] + data):
+            self.assertIsInstance(extended, CollectedData)
+            self.assertEqual(len(list(extended)), count + 1)
+            self.assertIn(extra, extended)
+
+        self.assertNotIn(extra, data)
+        self.assertEqual(len(list(data)), count)
+
+        with self.assertRaises(TypeError):
+            data[:1]
+
+        with self.assertRaises(TypeError):
+            data.index(unrelated[0])
+
+
+class BatchSizeTestCase(TestCase):
+    fixtures = ["auth.json", "example.json"]
+
+    def test_chunked_filters(self):
+        """
+        No query is sent more pks than the batch size, with the same result
+        """
+        creator = ExampleDevDBCreator()
+        expected = {
+            (type(x), x.pk) for x in creator.collect_data(creator.get_model_settings())
+        }
+
+        creator.batch_size = 2
+
+        for pks_only in (False, True):
+            creator.resolve_pks_only = pks_only
+
+            with CaptureQueriesContext(connection) as queries:
+                data = creator.collect_data(creator.get_model_settings())
+
+            self.assertEqual({(type(x), x.pk) for x in data}, expected)
+
+            for query in queries:
+                self.assertNotIn("NOT", query["sql"])
+
+                for values in query["sql"].split(" IN (")[1:]:
+                    self.assertLessEqual(values.split(")")[0].count(","), 1)
+
+
+class WorkersTestCase(TransactionTestCase):
+    fixtures = ["auth.json", "example.json"]
+    serialized_rollback = True
+
+    def _collect(self, workers, pks_only=False):
+        _, _, data = collect(workers=workers, resolve_pks_only=pks_only)
+        return [(type(x), x.pk) for x in data]
+
+    def test_deterministic(self):
+        """
+        The collected data do not depend on the number of workers
+        """
+        for pks_only in (False, True):
+            expected = self._collect(1, pks_only)
+            self.assertTrue(expected)
+            self.assertEqual(self._collect(4, pks_only), expected)
+
+
+class BudgetTestCase(TestCase):
+    fixtures = ["auth.json", "example.json"]
+
+    def test_max_rows(self):
+        """
+        The optional dependencies stop once the budget is spent, but the sampled
+        rows and their forward dependencies are kept
+        """
+        _, _, full = collect()
+        creator, model_settings, data = collect(max_rows=5)
+        self.assertLess(len(data), len(full))
+        self.assertLess(
+            len([x for x in data if isinstance(x, ReverseDependency)]),
+            len([x for x in full if isinstance(x, ReverseDependency)]),
+        )
+
+        keys = {(type(x), x.pk) for x in data}
+
+        for model, limit in model_settings:
+            if model not in (User, UserDependency, ReverseDependency, Loop):
+                sampled = model._default_manager.order_by("-pk")[:limit]
+                self.assertLessEqual({(model, x.pk) for x in sampled}, keys)
+
+        for instance in data:
+            for field in instance._meta.concrete_fields:
+                if field.is_relation and getattr(instance, field.attname):
+                    key = (field.related_model, getattr(instance, field.attname))
+                    self.assertIn(key, keys)
+
+    def test_max_bytes(self):
+        """
+        The bytes budget works the same way, with estimated row sizes
+        """
+        _, _, full = collect()
+        _, _, data = collect(max_bytes=256)
+        self.assertLess(len(data), len(full))
+
+
+class SamplingTestCase(TestCase):
+    fixtures = ["auth.json", "example.json"]
+
+    def _sample(self, sampler, model, limit, batch_size=None):
+        table_size = TableSize(model.objects.count(), None)
+        sample = sampler.sample(model, limit, table_size, batch_size)
+        return list(chain.from_iterable(sample_querysets(sample)))
+
+    def test_latest(self):
+        """
+        The default sampler takes the newest rows
+        """
+        sample = self._sample(LatestSampler(), Extra, 5)
+        self.assertEqual(sample, list(Extra.objects.order_by("-pk")[:5]))
+
+    def test_random_pk(self):
+        """
+        Random pks are sampled from the pk range, reproducibly with a seed
+        """
+        sample = self._sample(RandomPkSampler(seed=1), Extra, 5)
+        self.assertTrue(sample)
+        self.assertLessEqual(len(sample), 5)
+        self.assertNotEqual(sample, list(Extra.objects.order_by("pk")[: len(sample)]))
+        self.assertEqual(sample, self._sample(RandomPkSampler(seed=1), Extra, 5))
+
+    def test_random_pk_limit(self):
+        """
+        The limit is reached past max_candidates and on sparse pk ranges
+        """
+        sampler = RandomPkSampler(seed=1, max_candidates=4)
+        self.assertEqual(len(self._sample(sampler, Extra, 20)), 20)
+
+        Extra.objects.bulk_create(
+            Extra(pk=pk, extra_chars="sparse") for pk in range(1000, 100000, 1000)
+        )
+        sample = self._sample(sampler, Extra, 50)
+        self.assertEqual(len(sample), 50)
+        self.assertEqual(len({x.pk for x in sample}), 50)
+
+        count = Extra.objects.count()
+        self.assertEqual(len(self._sample(sampler, Extra, count + 10)), count)
+
+    def test_random_pk_batches(self):
+        """
+        The sampled pks are filtered batch_size at a time
+        """
+        sampler = RandomPkSampler(seed=1)
+        sample = sampler.sample(Extra, 20, batch_size=8)
+        self.assertEqual([len(x) for x in sample], [8, 8, 4])
+        self.assertEqual(
+            list(chain.from_iterable(sample)),
+            self._sample(RandomPkSampler(seed=1), Extra, 20),
+        )
+
+    def test_tablesample_fallback(self):
+        """
+        TABLESAMPLE falls back to random pks on databases not supporting it
+        """
+        sample = self._sample(TableSampleSampler(seed=1), Extra, 5)
+        self.assertEqual(sample, self._sample(RandomPkSampler(seed=1), Extra, 5))
+
+    def test_stratified(self):
+        """
+        Every value of the field gets its share of the sample
+        """
+        sample = self._sample(StratifiedSampler("content_type"), Permission, 20)
+        content_types = Permission.objects.values("content_type").distinct()
+        self.assertEqual(
+            {x.content_type_id for x in sample},
+            {x["content_type"] for x in content_types},
+        )
+
+    def test_stratified_limits(self):
+        """
+        The strata past the limit are dropped with a warning, and the pks of
+        the strata are filtered batch_size at a time
+        """
+        sampler = StratifiedSampler("content_type")
+        strata = Permission.objects.values("content_type").distinct().count()
+
+        with self.assertLogs("dev_db.sampling", "WARNING"):
+            sample = self._sample(sampler, Permission, strata - 1)
+
+        self.assertEqual(len({x.content_type_id for x in sample}), strata - 1)
+        self.assertEqual(
+            [len(x) for x in sampler.sample(Permission, strata, batch_size=2)],
+            [2] * (strata // 2) + [1] * (strata % 2),
+        )
+
+    def test_creator_samplers(self):
+        """
+        The sampler can be picked per model
+        """
+        creator = ExampleDevDBCreator()
+        creator.samplers = {"example.NotRelatedToUser": StratifiedSampler("dependency")}
+        data = creator.collect_data([(NotRelatedToUser, 2)])
+        self.assertEqual(
+            {x.dependency_id for x in data if isinstance(x, NotRelatedToUser)},
+            set(NotRelatedToUser.objects.values_list("dependency", flat=True)),
+        )
+
+
+class ProfilerTestCase(TestCase):
+    fixtures = ["auth.json", "example.json"]
+
+    def test_collection(self):
+        """
+        The queries of the collection are recorded per model and relation
+        """
+        creator = ExampleDevDBCreator()
+        creator.profiler = Profiler()
+        model_settings = creator.get_model_settings()
+
+        with CaptureQueriesContext(connection) as queries:
+            data = creator.collect_data(model_settings)
+
+        stats = creator.profiler.stats
+        recorded = [x for x in stats.values() if x.queries]
+        self.assertTrue(recorded)
+        self.assertLessEqual(sum(x.queries for x in recorded), len(queries))
+        sample = stats["example.NotRelatedToUser", "sample"]
+        self.assertEqual(sample.queries, 1)
+        self.assertEqual(sample.rows, NotRelatedToUser.objects.count())
+        self.assertEqual(stats["example.UserDependency", "reverse user"].rows, 3)
+        self.assertEqual(stats["example.Loop", "chain parent"].rows, 4)
+        self.assertTrue(data)
+        json.dumps(creator.profiler.to_json())
+
+    def test_serialization(self):
+        """
+        The rows and bytes written for every model are recorded
+        """
+        profiler = Profiler()
+
+        with tempfile.TemporaryDirectory() as directory:
+            path = Path(directory) / "data.json"
+            objects = chain(Extra.objects.order_by("pk"), Loop.objects.order_by("pk"))
+
+            with profiler.phase("serializing"):
+                write_fixture(path, "json", objects, profiler=profiler)
+
+            size = path.stat().st_size
+
+        self.assertEqual(profiler.stats["example.Extra", "serialize"].rows, 31)
+        self.assertEqual(profiler.stats["example.Loop", "serialize"].rows, 4)
+        self.assertEqual(sum(x.bytes for x in profiler.stats.values()), size - len("["))
+        self.assertEqual(profiler.phases[0][0], "serializing")
+        self.assertIn("example.Extra", profiler.report())
+
+    def test_serialization_bytes(self):
+        """
+        The bytes are counted encoded, and per model in the devdb chunks, the
+        header on its own
+        """
+        with tempfile.TemporaryDirectory() as directory:
+            profiler = Profiler()
+            path = Path(directory) / "data.json"
+            objects = [Extra(pk=1, extra_chars="é" * 100)]
+            write_fixture(path, "json", objects, profiler=profiler)
+            self.assertEqual(
+                profiler.stats["example.Extra", "serialize"].bytes,
+                path.stat().st_size - len("["),
+            )
+
+            profiler = Profiler()
+            path = Path(directory) / "data.devdb"
+            objects = chain(Extra.objects.order_by("pk"), Loop.objects.order_by("pk"))
+            write_fixture(path, "devdb", objects, profiler=profiler)
+            size = path.stat().st_size
+
+        written = {x: y.bytes for (x, _), y in profiler.stats.items() if y.bytes}
+        self.assertEqual(
+            set(written), {"example.Extra", "example.Loop", "devdb header"}
+        )
+        self.assertEqual(sum(written.values()), size)
+
+    def test_serialization_time(self):
+        """
+        The time spent producing the objects is not serialization time
+        """
+        profiler = Profiler()
+
+        def slow_objects():
+            for pk in range(3):
+                time.sleep(0.05)
+                yield Extra(pk=pk, extra_chars="x")
+
+        start = time.perf_counter()
+
+        for _ in profiler.serialized(slow_objects()):
+            time.sleep(0.01)
+
+        stats = profiler.stats["example.Extra", "serialize"]
+        self.assertEqual(stats.rows, 3)
+        self.assertGreaterEqual(stats.time, 0.03)
+        self.assertLess(stats.time, (time.perf_counter() - start) - 0.1)
+
+
+class FixtureWriterTestCase(SimpleTestCase):
+    def _write(self, path, count):
+        objects = (Extra(pk=pk, extra_chars="x" * 200) for pk in range(count))
+        write_fixture(path, "json", objects, indent=4)
+
+    def _peak_memory(self, count):
+        with tempfile.TemporaryDirectory() as directory:
+            tracemalloc.start()
+            try:
+                self._write(Path(directory) / "data.json.gz", count)
+                return tracemalloc.get_traced_memory()[1]
+            finally:
+                tracemalloc.stop()
+
+    def test_round_trip(self):
+        """
+        The streamed fixture can be deserialized again
+        """
+        with tempfile.TemporaryDirectory() as directory:
+            path = Path(directory) / "data.json.gz"
+            self._write(path, 10)
+
+            with open_fixture(path) as f:
+                objects = list(serializers.deserialize("json", f.read()))
+
+        self.assertEqual([x.object.pk for x in objects], list(range(10)))
+
+    def test_memory_bounded(self):
+        """
+        Peak memory does not grow with the number of serialized instances
+        """
+        small = self._peak_memory(500)
+        large = self._peak_memory(5000)
+        self.assertLess(large, small * 2)
+
+    def _read_peak_memory(self, count):
+        with tempfile.TemporaryDirectory() as directory:
+            path = Path(directory) / "data.json.gz"
+            self._write(path, count)
+            tracemalloc.start()
+            try:
+                for obj in read_fixture(path):
+                    pass
+                return tracemalloc.get_traced_memory()[1]
+            finally:
+                tracemalloc.stop()
+
+    def test_streamed_read(self):
+        """
+        The json and jsonl fixtures are deserialized one object at a time
+        """
+        for format in ("json", "jsonl"):
+            with tempfile.TemporaryDirectory() as directory:
+                path = Path(directory) / ("data.%s.gz" % format)
+                objects = (Extra(pk=pk, extra_chars="x") for pk in range(10))
+                write_fixture(path, format, objects)
+                objects = list(read_fixture(path))
+
+            self.assertEqual([x.object.pk for x in objects], list(range(10)))
+
+    def test_compressions(self):
+        """
+        The fixtures are compressed based on their suffix
+        """
+        for name, module in (
+            ("data.json", None),
+            ("data.json.gz", None),
+            ("data.json.zst", "zstandard"),
+            ("data.json.lz4", "lz4"),
+        ):
+            if module and importlib.util.find_spec(module) is None:
+                continue
+
+            with tempfile.TemporaryDirectory() as directory:
+                path = Path(directory) / name
+                objects = (Extra(pk=pk, extra_chars="x") for pk in range(10))
+                write_fixture(path, "json", objects, compression_level=1)
+                objects = list(read_fixture(path))
+
+            self.assertEqual([x.object.pk for x in objects], list(range(10)))
+
+    def test_parallel_gzip(self):
+        """
+        The blocks compressed in parallel form a single valid gzip file
+        """
+        with tempfile.TemporaryDirectory() as directory:
+            path = Path(directory) / "data.gz"
+            data = b"".join(b"line %d\n" % x for x in range(100000))
+
+            with ParallelGzipWriter(open(path, "wb"), threads=4, block_size=1000) as f:
+                f.write(data)
+
+            with gzip.open(path, "rb") as f:
+                self.assertEqual(f.read(), data)
+
+            path = Path(directory) / "data.json.gz"
+            objects = (Extra(pk=pk, extra_chars="x") for pk in range(1000))
+            write_fixture(path, "json", objects, threads=4)
+            objects = list(read_fixture(path))
+
+        self.assertEqual([x.object.pk for x in objects], list(range(1000)))
+
+    def test_read_memory_bounded(self):
+        """
+        Peak memory does not grow with the number of deserialized instances
+        """
+        small = self._read_peak_memory(500)
+        large = self._read_peak_memory(5000)
+        self.assertLess(large, small * 2)
+
+
+class LoaderTestCase(TestCase):
+    fixtures = ["auth.json", "example.json"]
+    models = [
+        NotRelatedToUserDependency,
+        NotRelatedToUser,
+        M2MRegular,
+        ForwardDependency,
+        UserDependency,
+        ReverseDependency,
+        Loop,
+        Extra,
+    ]
+
+    def _snapshot(self):
+        return {
+            model: sorted(model.objects.values_list(), key=str) for model in self.models
+        }
+
+    def _m2m_snapshot(self):
+        return sorted(
+            M2MRegular.m2m.through.objects.values_list("m2mregular", "notrelatedtouser")
+        )
+
+    def _reload(self, name, format, jobs=None, ordered=False, loader=None):
+        """
+        Writes the rows to a fixture, deletes them and loads them back, table
+        by table with load_tables if jobs is given, or in the order of
+        order_data with the constraints checked if ordered
+        """
+        expected = self._snapshot()
+        expected_m2m = self._m2m_snapshot()
+
+        with tempfile.TemporaryDirectory() as directory:
+            path = Path(directory) / name
+            objects = chain.from_iterable(
+                model.objects.order_by("pk") for model in self.models
+            )
+
+            if ordered:
+                objects = ExampleDevDBCreator().order_data(objects)
+
+            write_fixture(path, format, objects)
+
+            for model in reversed(self.models):
+                model.objects.all().delete()
+
+            loader = loader or BulkLoader(batch_size=2, buffer_size=5)
+
+            if jobs:
+                with fixture_tables(path) as tables:
+                    count = loader.load_tables(tables, jobs=jobs)
+            else:
+                count = loader.load(read_fixture(path), ordered=ordered)
+
+        self.assertEqual(self._snapshot(), expected)
+        self.assertEqual(self._m2m_snapshot(), expected_m2m)
+        self.assertEqual(count, sum(map(len, expected.values())) + len(expected_m2m))
+        return expected
+
+    def test_load(self):
+        """
+        The bulk loader restores the fixture rows, including the m2m rows
+        """
+        expected = self._reload("data.json.gz", "json")
+        self.assertGreater(
+            Extra.objects.create(extra_chars="new").pk,
+            max(x[0] for x in expected[Extra]),
+        )
+
+    def test_load_existing_rows(self):
+        """
+        The rows already in the database are replaced by the fixture rows
+        """
+        expected = self._snapshot()
+        expected_m2m = self._m2m_snapshot()
+
+        with tempfile.TemporaryDirectory() as directory:
+            path = Path(directory) / "data.json"
+            write_fixture(
+                path,
+                "json",
+                chain.from_iterable(
+                    model.objects.order_by("pk") for model in self.models
+                ),
+            )
+            Extra.objects.update(extra_chars="changed")
+            NotRelatedToUser.objects.filter(pk=1).delete()
+            count = BulkLoader(batch_size=2, buffer_size=5).load(read_fixture(path))
+
+        self.assertEqual(self._snapshot(), expected)
+        self.assertEqual(self._m2m_snapshot(), expected_m2m)
+        self.assertEqual(count, sum(map(len, expected.values())) + len(expected_m2m))
+
+    def test_load_ordered(self):
+        """
+        The fixtures in dependency order are loaded with the constraints on
+        """
+        Loop.objects.create(pk=10, loop_text="root")
+        Loop.objects.filter(pk=1).update(parent=10)
+
+        with mock.patch.object(
+            BulkLoader, "constraint_checks_deferred"
+        ) as deferred, mock.patch.object(BulkLoader, "check_constraints") as check:
+            self._reload("data.json", "json", ordered=True)
+
+        self.assertFalse(deferred.called)
+        self.assertFalse(check.called)
+
+    def test_load_devdb(self):
+        """
+        The devdb fixtures hold the same rows as the json ones
+        """
+        self._reload("data.devdb", "devdb")
+
+    def test_load_tables(self):
+        """
+        The tables are loaded level by level, from json and devdb fixtures
+        """
+        self._reload("data.json.gz", "json", jobs=1)
+        self._reload("data.devdb", "devdb", jobs=1)
+
+    @skipUnless(connection.vendor == "sqlite", "SQLite allows a single writer")
+    def test_sqlite_jobs(self):
+        """
+        The tables are loaded one by one on SQLite, with a warning
+        """
+        with self.assertLogs("dev_db.loaders", "WARNING"):
+            self.assertEqual(BulkLoader().get_jobs(2), 1)
+
+    def test_dependency_levels(self):
+        """
+        The models of a level only reference models of the previous levels
+        """
+        levels = dependency_levels(self.models)
+        level_of = {
+            model: i
+            for i, level in enumerate(levels)
+            for group in level
+            for model in group
+        }
+
+        self.assertEqual(sorted(level_of, key=str), sorted(self.models, key=str))
+        self.assertEqual(level_of[NotRelatedToUserDependency], 0)
+        self.assertEqual(level_of[NotRelatedToUser], 1)
+        self.assertEqual(level_of[M2MRegular], 2)
+
+        for model in self.models:
+            for field in model._meta.concrete_fields:
+                if field.is_relation and field.related_model in level_of:
+                    if field.related_model is not model:
+                        self.assertLess(level_of[field.related_model], level_of[model])
+
+    def test_devdb_m2m_queries(self):
+        """
+        The many to many targets of a devdb chunk are selected in one query
+        """
+        instances = list(M2MRegular.objects.order_by("pk"))
+        self.assertGreater(len(instances), 1)
+
+        with tempfile.TemporaryDirectory() as directory:
+            path = Path(directory) / "data.devdb"
+
+            with CaptureQueriesContext(connection) as queries:
+                write_fixture(path, "devdb", instances)
+
+            objects = list(read_fixture(path))
+
+        self.assertEqual(len(queries), 1)
+        self.assertEqual(
+            [sorted(x.m2m_data["m2m"]) for x in objects],
+            [sorted(x.m2m.values_list("pk", flat=True)) for x in instances],
+        )
+
+    def test_devdb_order(self):
+        """
+        The tables of a devdb fixture are read in their dependency order
+        """
+        with tempfile.TemporaryDirectory() as directory:
+            path = Path(directory) / "data.devdb"
+            objects = chain.from_iterable(
+                model.objects.order_by("pk") for model in reversed(self.models)
+            )
+            write_fixture(path, "devdb", objects)
+            models = list(dict.fromkeys(type(x.object) for x in read_fixture(path)))
+
+        for model in self.models:
+            for field in model._meta.concrete_fields:
+                if field.is_relation and field.related_model in models:
+                    self.assertLessEqual(
+                        models.index(field.related_model), models.index(model)
+                    )
+
+    def test_copy_values(self):
+        """
+        The values are converted to the text format of COPY
+        """
+        loader = PostgreSQLCopyLoader()
+        fields = [
+            ForwardDependency._meta.get_field("id"),
+            ForwardDependency._meta.get_field("bool"),
+        ]
+        text = NotRelatedToUserDependency._meta.get_field("text")
+
+        self.assertEqual(
+            loader.copy_row(fields, ForwardDependency(pk=3, bool=False)), "3\tf\n"
+        )
+        self.assertEqual(
+            loader.copy_value(text, NotRelatedToUserDependency(text="a\tb\\c\n")),
+            "a\\tb\\\\c\\n",
+        )
+        self.assertEqual(
+            loader.copy_value(text, NotRelatedToUserDependency(text=None)), "\\N"
+        )
+
+    def test_copy_profiled(self):
+        """
+        The COPY goes through the execute wrappers, so it is profiled
+        """
+        loader = PostgreSQLCopyLoader(profiler=Profiler())
+        instances = list(Extra.objects.order_by("pk"))
+
+        with mock.patch.object(PostgreSQLCopyLoader, "copy") as copy:
+            with loader.measure(Extra, "insert") as stats:
+                loader.insert(Extra, instances)
+
+        self.assertEqual(copy.call_count, 1)
+        self.assertEqual(stats.queries, 1)
+        self.assertEqual(copy.call_args[0][2].count("\n"), len(instances))
+
+    @skipUnless(connection.vendor == "postgresql", "COPY needs PostgreSQL")
+    def test_load_copy(self):
+        """
+        The rows are restored with COPY, whose queries are profiled
+        """
+        profiler = Profiler()
+        loader = PostgreSQLCopyLoader(batch_size=2, buffer_size=5, profiler=profiler)
+        self._reload("data.json", "json", loader=loader)
+        self.assertTrue(profiler.stats["example.Extra", "insert"].queries)
+
+    @contextmanager
+    def _devdb_header(self, path):
+        """
+        Yields the header of the devdb fixture, written back once edited
+        """
+        data = path.read_bytes()
+        end = len(data) - columnar.LENGTH.size - len(columnar.MAGIC)
+        (length,) = columnar.LENGTH.unpack(data[end : end + columnar.LENGTH.size])
+        header = json.loads(data[end - length : end])
+        yield header
+        header = json.dumps(header).encode("utf-8")
+        path.write_bytes(
+            data[: end - length]
+            + header
+            + columnar.LENGTH.pack(len(header))
+            + columnar.MAGIC
+        )
+
+    def test_devdb_version(self):
+        """
+        The devdb fixtures of another version are refused
+        """
+        with tempfile.TemporaryDirectory() as directory:
+            path = Path(directory) / "data.devdb"
+            write_fixture(path, "devdb", [Extra(pk=1, extra_chars="x")])
+
+            with self._devdb_header(path) as header:
+                header["version"] = 1
+
+            with self.assertRaisesRegex(DeserializationError, "version 1"):
+                list(read_fixture(path))
+
+    def test_ignorenonexistent(self):
+        """
+        The fields missing from the models raise, as with loaddata, unless
+        ignorenonexistent
+        """
+        with tempfile.TemporaryDirectory() as directory:
+            path = Path(directory) / "data.json"
+            fields = {"extra_chars": "x", "missing": 1}
+            path.write_text(
+                json.dumps([{"model": "example.extra", "pk": 1, "fields": fields}])
+            )
+
+            with self.assertRaises(FieldDoesNotExist):
+                list(read_fixture(path))
+
+            (obj,) = read_fixture(path, ignorenonexistent=True)
+            self.assertEqual(obj.object.extra_chars, "x")
+
+            # a devdb fixture with a column renamed in its header
+            path = Path(directory) / "data.devdb"
+            write_fixture(path, "devdb", [Extra(pk=1, extra_chars="x")])
+
+            with self._devdb_header(path) as header:
+                header["tables"][0]["columns"][1] = "missing"
+
+            with self.assertRaises(FieldDoesNotExist):
+                list(read_fixture(path))
+
+            (obj,) = read_fixture(path, ignorenonexistent=True)
+            self.assertEqual(obj.object.pk, 1)
+            self.assertEqual(obj.object.extra_chars, "")
+
+
+class LoadTablesTestCase(TransactionTestCase):
+    fixtures = ["auth.json", "example.json"]
+    # restores the content types the fixtures reference after the flushes
+    serialized_rollback = True
+
+    def test_jobs(self):
+        """
+        The tables of a level are loaded by the threads of the pool, each on
+        its own connection, the groups one at a time as SQLite has a single
+        writer
+        """
+        models = LoaderTestCase.models
+        expected = {model: sorted(model.objects.values_list()) for model in models}
+        lock = threading.Lock()
+        threads = set()
+        load_group = BulkLoader.load_group
+
+        def locked_load_group(loader, tables, group):
+            threads.add(threading.get_ident())
+
+            with lock:
+                return load_group(loader, tables, group)
+
+        with tempfile.TemporaryDirectory() as directory:
+            path = Path(directory) / "data.devdb"
+            objects = chain.from_iterable(x.objects.order_by("pk") for x in models)
+            write_fixture(path, "devdb", objects)
+
+            for model in reversed(models):
+                model.objects.all().delete()
+
+            with mock.patch.object(
+                BulkLoader, "get_jobs", lambda self, jobs: jobs
+            ), mock.patch.object(
+                BulkLoader, "load_group", locked_load_group
+            ), fixture_tables(
+                path
+            ) as tables:
+                BulkLoader(batch_size=2).load_tables(tables, jobs=2)
+
+        self.assertEqual(
+            {model: sorted(model.objects.values_list()) for model in models},
+            expected,
+        )
+        self.assertTrue(threads)
+        self.assertNotIn(threading.get_ident(), threads)
+
+
+class IncrementalTestCase(TestCase):
+    fixtures = ["auth.json", "example.json"]
+    models = [NotRelatedToUserDependency, NotRelatedToUser, M2MRegular]
+
+    def _snapshot(self):
+        snapshot = {
+            model: sorted(model.objects.values_list(), key=str) for model in self.models
+        }
+        snapshot["m2m"] = sorted(
+            M2MRegular.m2m.through.objects.values_list("m2mregular", "notrelatedtouser")
+        )
+        return snapshot
+
+    def _objects(self):
+        return list(
+            chain.from_iterable(model.objects.order_by("pk") for model in self.models)
+        )
+
+    def _change(self):
+        """
+        Changes a row and a many to many relation, deletes a row and adds one
+        """
+        NotRelatedToUser.objects.filter(pk=1).update(text="changed")
+        M2MRegular.objects.get(pk=1).m2m.set([1, 2])
+        M2MRegular.objects.filter(pk=2).delete()
+        dependency = NotRelatedToUserDependency.objects.create(text="new")
+        return NotRelatedToUser.objects.create(dependency=dependency, text="new")
+
+    def _collect_delta(self, manifest):
+        creator = ExampleDevDBCreator()
+        model_settings = [(NotRelatedToUser, 3)]
+        return creator.collect_delta(model_settings, manifest)
+
+    def test_delta(self):
+        """
+        Only the new and changed rows are collected, with the new dependencies
+        """
+        manifest = Manifest.from_objects(self._objects())
+        new = self._change()
+        objects, delta = self._collect_delta(manifest)
+
+        self.assertEqual(
+            sorted((model_name(type(x)), x.pk) for x in objects),
+            [
+                # added by add_extra_data, missing from the manifest
+                ("example.Extra", Extra.objects.first().pk),
+                ("example.M2MRegular", 1),
+                ("example.NotRelatedToUser", 1),
+                ("example.NotRelatedToUser", new.pk),
+                ("example.NotRelatedToUserDependency", new.dependency_id),
+            ],
+        )
+        self.assertEqual(delta.deleted, {M2MRegular: {2}})
+        self.assertEqual(delta.replaced, {M2MRegular: {1}, NotRelatedToUser: {1}})
+        self.assertEqual(
+            delta.rows,
+            Manifest.from_objects(self._objects() + [Extra.objects.first()]).rows,
+        )
+
+    def test_unchanged_delta(self):
+        """
+        The delta of an unchanged database is empty, the custom data models
+        are not sampled again and the extra data are not added again
+        """
+        creator = ExampleDevDBCreator()
+        model_settings = creator.get_model_settings()
+        manifest = Manifest.from_objects(
+            creator.add_extra_data(creator.collect_data(model_settings))
+        )
+        objects, delta = ExampleDevDBCreator().collect_delta(model_settings, manifest)
+
+        self.assertEqual(list(objects), [])
+        self.assertFalse(delta.is_delta)
+
+    def test_manifest_round_trip(self):
+        """
+        The manifests are saved and loaded with their deleted and replaced rows
+        """
+        manifest = Manifest.from_objects(self._objects())
+        manifest = manifest.updated([], {M2MRegular: {2}}, {NotRelatedToUser: {1}})
+
+        with tempfile.TemporaryDirectory() as directory:
+            path = manifest_path(Path(directory) / "data.json.gz")
+            manifest.save(path)
+            loaded = Manifest.load(path)
+
+        self.assertEqual(loaded.rows, manifest.rows)
+        self.assertEqual(loaded.deleted, manifest.deleted)
+        self.assertEqual(loaded.replaced, manifest.replaced)
+
+    def test_load_delta(self):
+        """
+        The delta applied on top of the previous snapshot gives the new rows
+        """
+        with tempfile.TemporaryDirectory() as directory:
+            path = Path(directory) / "data.json.gz"
+            write_fixture(path, "json", self._objects())
+            manifest = Manifest.from_objects(self._objects())
+
+            self._change()
+            expected = self._snapshot()
+            objects, delta = self._collect_delta(manifest)
+            delta_path = Path(directory) / "delta.json.gz"
+            write_fixture(delta_path, "json", objects)
+
+            for model in reversed(self.models):
+                model.objects.all().delete()
+
+            BulkLoader().load(read_fixture(path))
+            BulkLoader(batch_size=2).load_delta(read_fixture(delta_path), delta)
+
+        self.assertEqual(self._snapshot(), expected)
@@ -47,7 +47,7 @@ setup(
     zip_safe=False,
     install_requires=install_requires,
     tests_require=tests_require,
-    extras_require={"test": tests_require},
+    extras_require={"test": tests_require, "zstd": ["zstandard"], "lz4": ["lz4"]},
     test_suite="runtests.runtests",
     include_package_data=True,
     classifiers=CLASSIFIERS,